@@ -0,0 +1,146 @@
+import json
+import logging
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+# Для поиска дублей берём самые длинные слова текста: они редкие и лучше всего отбирают кандидатов
+_DUP_QUERY_WORDS = 16
+_DUP_CANDIDATES = 5
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower())
+
+
+def _match_query(words: Iterable[str], op: str = " ") -> str:
+    # Каждое слово — префиксный запрос в кавычках: падежные окончания не мешают («гонка» найдёт «гонки»),
+    # а кавычки экранируют синтаксис FTS5 во вводе пользователя
+    stems = [w[:-2] if len(w) > 6 else w[:-1] if len(w) > 4 else w for w in words]
+    return op.join(f'"{w}"*' for w in dict.fromkeys(stems))
+
+
+def similarity(a: str, b: str) -> float:
+    """Коэффициент Жаккара по парам соседних слов: 1.0 — тот же текст, ~0 — разные тексты."""
+    def shingles(text: str) -> set:
+        words = _words(text)
+        return set(zip(words, words[1:])) or set(words)
+
+    sa, sb = shingles(a), shingles(b)
+    if not sa or not sb:
+        return 0.0
+    return len(sa & sb) / len(sa | sb)
+
+
+@dataclass(slots=True)
+class ArchivedPost:
+    id: int
+    published_at: float  # unix-время
+    author: int
+    style: Optional[str]
+    post_text: str
+    snippet: str = ""  # фрагмент с найденными словами (только в результатах поиска)
+    score: float = 0.0  # близость к проверяемому тексту (только в near_duplicate)
+
+
+class PostArchive:
+    """Архив опубликованных постов в SQLite: таблица archive_posts и FTS5-индекс по тексту поста
+    и исходному тексту (external content — текст хранится один раз, индекс обновляют триггеры).
+
+    Поиск ранжируется bm25 и постранично читает только нужную страницу; проверка на дубль
+    отбирает кандидатов тем же индексом и точно сравнивает лишь несколько из них."""
+
+    def __init__(self, path: Optional[str] = None, dup_threshold: float = 0.6, dup_days: float = 30):
+        self.dup_threshold = dup_threshold
+        self.dup_days = dup_days
+        # Без пути архив живёт в памяти до рестарта — поиск и дубли всё равно работают
+        self._conn = sqlite3.connect(path or ":memory:")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS archive_posts ("
+            "id INTEGER PRIMARY KEY, published_at REAL NOT NULL, edited_at REAL, author INTEGER NOT NULL, "
+            "channels TEXT NOT NULL, style TEXT, post_text TEXT NOT NULL, source_text TEXT NOT NULL, "
+            "media TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS archive_posts_published ON archive_posts (published_at);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5("
+            "post_text, source_text, content='archive_posts', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3');"
+            "CREATE TRIGGER IF NOT EXISTS archive_posts_ai AFTER INSERT ON archive_posts BEGIN "
+            "INSERT INTO archive_fts (rowid, post_text, source_text) VALUES (new.id, new.post_text, new.source_text); "
+            "END;"
+            "CREATE TRIGGER IF NOT EXISTS archive_posts_ad AFTER DELETE ON archive_posts BEGIN "
+            "INSERT INTO archive_fts (archive_fts, rowid, post_text, source_text) "
+            "VALUES ('delete', old.id, old.post_text, old.source_text); "
+            "END;"
+        )
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM archive_posts").fetchone()[0]
+
+    def add(self, author: int, post_text: str, source_text: str, style: Optional[str], media: List[dict],
+            channels: List[str], edited_at: Optional[float] = None, published_at: Optional[float] = None) -> int:
+        with self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO archive_posts (published_at, edited_at, author, channels, style, post_text, "
+                "source_text, media) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (published_at or time.time(), edited_at, author, json.dumps(list(channels)), style,
+                 post_text, source_text or "", json.dumps(media, ensure_ascii=False, separators=(",", ":"))),
+            )
+        return cur.lastrowid
+
+    def get(self, post_id: int) -> Optional[ArchivedPost]:
+        row = self._conn.execute(
+            "SELECT id, published_at, author, style, post_text FROM archive_posts WHERE id = ?", (post_id,)
+        ).fetchone()
+        return ArchivedPost(*row) if row else None
+
+    def search(self, query: str, limit: int = 5, offset: int = 0) -> Tuple[int, List[ArchivedPost]]:
+        """Посты, где есть все слова запроса, лучшие (bm25) первыми. Возвращает (всего найдено, страница)."""
+        match = _match_query(_words(query))
+        if not match:
+            return 0, []
+        try:
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM archive_fts WHERE archive_fts MATCH ?", (match,)
+            ).fetchone()[0]
+            # Совпадение в тексте поста весит вдвое больше, чем в исходнике
+            rows = self._conn.execute(
+                "SELECT p.id, p.published_at, p.author, p.style, p.post_text, "
+                "snippet(archive_fts, 0, '«', '»', '…', 12) "
+                "FROM archive_fts JOIN archive_posts p ON p.id = archive_fts.rowid "
+                "WHERE archive_fts MATCH ? ORDER BY bm25(archive_fts, 2.0, 1.0) LIMIT ? OFFSET ?",
+                (match, limit, offset),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.warning("Archive search failed for %r: %s", query, e)
+            return 0, []
+        return total, [ArchivedPost(*row) for row in rows]
+
+    def near_duplicate(self, text: str) -> Optional[ArchivedPost]:
+        """Самый похожий пост за последние dup_days дней, если сходство не ниже dup_threshold."""
+        words = sorted(set(_words(text)), key=len, reverse=True)[:_DUP_QUERY_WORDS]
+        if not words:
+            return None
+        # Кандидаты — из индекса (любое из редких слов, лучшие по bm25), точное сравнение — только для них
+        rows = self._conn.execute(
+            "SELECT p.id, p.published_at, p.author, p.style, p.post_text "
+            "FROM archive_fts JOIN archive_posts p ON p.id = archive_fts.rowid "
+            "WHERE archive_fts MATCH ? AND p.published_at >= ? ORDER BY bm25(archive_fts, 1.0, 0.0) LIMIT ?",
+            ("post_text : (" + _match_query(words, " OR ") + ")",
+             time.time() - self.dup_days * 86400, _DUP_CANDIDATES),
+        ).fetchall()
+        best = None
+        for row in rows:
+            post = ArchivedPost(*row)
+            post.score = similarity(text, post.post_text)
+            if post.score >= self.dup_threshold and (best is None or post.score > best.score):
+                best = post
+        return best
+
+    def close(self) -> None:
+        self._conn.close()
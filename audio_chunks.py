@@ -0,0 +1,70 @@
+import asyncio
+import os
+import re
+import shutil
+from difflib import SequenceMatcher
+from typing import List, Optional
+
+FFMPEG = os.getenv("FFMPEG_BIN", "ffmpeg")
+
+_NON_WORD = re.compile(r"\W+")
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG) is not None
+
+
+def segment_starts(duration: float, window: float, overlap: float) -> List[float]:
+    """Начала перекрывающихся окон длиной window, покрывающих всю запись."""
+    step = max(window - overlap, 1.0)
+    starts = [0.0]
+    while starts[-1] + window < duration:
+        starts.append(starts[-1] + step)
+    return starts
+
+
+async def cut_segment(data: memoryview, start: float, length: float) -> bytes:
+    """Вырезает кусок [start, start + length) и перекодирует в моно FLAC 16 кГц.
+    Вход и выход идут через пайпы ffmpeg — временные файлы не создаются."""
+    proc = await asyncio.create_subprocess_exec(
+        FFMPEG, "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-ss", f"{start:.2f}", "-t", f"{length:.2f}",
+        "-ac", "1", "-ar", "16000", "-c:a", "flac", "-f", "flac", "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    out, err = await proc.communicate(data)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {err.decode(errors='replace').strip()[:200]}")
+    return out
+
+
+def _norm(word: str) -> str:
+    return _NON_WORD.sub("", word.lower())
+
+
+def _merge(left: List[str], right: List[str], window: int) -> List[str]:
+    """Склеивает два соседних куска по самому длинному общему фрагменту на стыке.
+    Слова на краях окна часто обрезаны, поэтому точного совпадения хвоста и начала не требуем."""
+    tail = left[-window:]
+    head = right[:window]
+    match = SequenceMatcher(
+        None, [_norm(w) for w in tail], [_norm(w) for w in head], autojunk=False,
+    ).find_longest_match(0, len(tail), 0, len(head))
+    # Одно короткое слово («и», «на») — скорее совпадение, чем перекрытие
+    if match.size == 0 or (match.size == 1 and len(_norm(tail[match.a])) < 4):
+        return left + right
+    cut = len(left) - len(tail) + match.a + match.size
+    return left[:cut] + right[match.b + match.size:]
+
+
+def stitch(parts: List[Optional[str]], overlap_words: int = 15) -> Optional[str]:
+    """Склеивает расшифровки сегментов по порядку, убирая дублирование на перекрытиях.
+    overlap_words — сколько слов на стыке просматривать (с запасом к длине перекрытия)."""
+    words: List[str] = []
+    for part in parts:
+        if part:
+            words = _merge(words, part.split(), overlap_words)
+    return " ".join(words) or None
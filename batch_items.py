@@ -0,0 +1,69 @@
+import csv
+import io
+import re
+from typing import List, Optional
+
+# Разделитель пунктов в тексте: строка из трёх и более дефисов (как в bench/posts_corpus.txt)
+_SEPARATOR_RE = re.compile(r"^\s*-{3,}\s*$", re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r"\n\s*\n")
+# Колонки CSV, в которых лежит готовый текст пункта
+_TEXT_COLUMNS = ("text", "текст", "описание", "пост", "post")
+
+
+def split_text(text: str) -> List[str]:
+    """Делит текст на пункты: по строкам «---», а если их нет — по пустым строкам."""
+    text = (text or "").replace("\r\n", "\n")
+    parts = _SEPARATOR_RE.split(text) if _SEPARATOR_RE.search(text) else _BLANK_LINES_RE.split(text)
+    return [p.strip() for p in parts if p.strip()]
+
+
+def split_csv(text: str) -> List[str]:
+    """Каждая строка CSV — пункт. Если есть колонка с текстом (text/текст/…) — берём её,
+    иначе склеиваем ячейки как «заголовок: значение» (результаты сессий: сессия, позиция, пилот…)."""
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(io.StringIO(text), dialect) if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+    header: Optional[List[str]] = None
+    try:
+        if csv.Sniffer().has_header(text[:4096]):
+            header = [h.strip() for h in rows[0]]
+            rows = rows[1:]
+    except csv.Error:
+        pass
+    if header:
+        lowered = [h.lower() for h in header]
+        for name in _TEXT_COLUMNS:
+            if name in lowered:
+                column = lowered.index(name)
+                return [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+    items = []
+    for row in rows:
+        cells = [c.strip() for c in row]
+        if header:
+            pairs = [f"{h}: {c}" if h else c for h, c in zip(header, cells) if c]
+        else:
+            pairs = [c for c in cells if c]
+        items.append("; ".join(pairs))
+    return items
+
+
+def decode_upload(data: bytes) -> str:
+    # Таблицы из Excel под Windows часто приходят в cp1251
+    for encoding in ("utf-8-sig", "cp1251"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def parse_upload(filename: str, data: bytes) -> List[str]:
+    """Пункты из загруженного файла: .csv — построчно, остальное — как текст."""
+    text = decode_upload(data)
+    if (filename or "").lower().endswith(".csv"):
+        return split_csv(text)
+    return split_text(text)
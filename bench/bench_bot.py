@@ -0,0 +1,238 @@
+"""Нагрузочный бенчмарк бота без сети: заглушки Bot API и OpenAI (bench/fake_api.py),
+синтетические апдейты идут через настоящий Dispatcher из bot.py.
+
+Каждый виртуальный админ проходит сценарий: текст (или голосовое) → «Перегенерировать» →
+выбор стиля → «Опубликовать». Отчёт: p50/p95/p99 задержки обработки по типам апдейтов,
+апдейтов в секунду, рост памяти (tracemalloc) и число вызовов внешних API.
+
+Запуск из корня репозитория:
+    python bench/bench_bot.py [--users 50] [--rounds 2] [--voice-share 0.25] [--openai-latency 800]
+
+Переменные бота (STREAM_POSTS, OPENAI_CONCURRENCY, PUBLISH_RATE_PER_MIN…) берутся из окружения,
+как при обычном запуске; токены и адреса API бенчмарк подставляет сам.
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import logging
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_api import FakeOpenAI, FakeTelegram  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(__file__), "posts_corpus.txt")
+BASE_USER_ID = 10_000
+CHANNEL_ID = "-1001000000001"
+STYLES = ("classic", "funny", "report")
+
+_update_ids = itertools.count(1)
+
+
+def load_corpus() -> list[str]:
+    with open(CORPUS, encoding="utf-8") as f:
+        return [p.strip() for p in f.read().split("\n---\n") if p.strip()]
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "Bench"}
+
+
+def _chat(user_id: int) -> dict:
+    return {"id": user_id, "type": "private", "first_name": "Bench"}
+
+
+def text_update(user_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": _chat(user_id), "from": _user(user_id),
+        "text": text,
+    }}
+
+
+def voice_update(user_id: int, duration: int = 20) -> dict:
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": _chat(user_id), "from": _user(user_id),
+        "voice": {"file_id": f"voice{update_id}", "file_unique_id": f"voice{update_id}",
+                  "duration": duration, "mime_type": "audio/ogg", "file_size": 32 * 1024},
+    }}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": _user(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "chat": _chat(user_id),
+            "from": {"id": 1, "is_bot": True, "first_name": "Bench"}, "text": "…",
+        },
+    }}
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def setup_env(args, telegram_url: str, openai_url: str) -> None:
+    """Окружение для bot.py — до его импорта: конфигурация читается при импорте модуля."""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:bench-token",
+        "TELEGRAM_API_URL": telegram_url,
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "TELEGRAM_CHANNEL_ID": CHANNEL_ID,
+        "TELEGRAM_CHANNEL_IDS": "",
+        # Пустые списки админов — доступ всем виртуальным пользователям
+        "ADMIN_USER_IDS": "",
+        "ADMIN_USERNAMES": "",
+        "SESSION_DB_PATH": args.db or "",
+        "SCHEDULE_DB_PATH": "",
+        "OPENAI_CACHE_PATH": "",
+        "ARCHIVE_DB_PATH": "",
+        # Заглушка OpenAI всегда отвечает одним и тем же постом: проверка на дубль выполняется, но не срабатывает
+        "ARCHIVE_DUP_THRESHOLD": "1.01",
+        "WARM_UP": "0",
+    })
+    # Лимиты публикации в один канал меряют Telegram, а не бота; --real-publish-limits оставляет их
+    if not args.real_publish_limits:
+        os.environ.setdefault("PUBLISH_RATE_PER_MIN", "60000")
+        os.environ.setdefault("PUBLISH_BURST", "1000")
+
+
+class Driver:
+    def __init__(self, bot_module, texts: list[str], voice_share: float):
+        self.bm = bot_module
+        self.texts = texts
+        self.voice_share = voice_share
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors = 0
+
+    async def feed(self, kind: str, update: dict) -> None:
+        started = time.perf_counter()
+        try:
+            await self.bm.dp.feed_raw_update(self.bm.bot, update)
+        except Exception:
+            self.errors += 1
+            logging.exception("update %s failed", kind)
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    def button(self, action: str, draft: int, arg: str | None = None) -> str:
+        return self.bm.DraftCb(action=action, draft=draft, arg=arg).pack()
+
+    async def scenario(self, user_id: int, rnd: random.Random) -> None:
+        before = set(self.bm._user_drafts(user_id))
+        if rnd.random() < self.voice_share:
+            await self.feed("voice", voice_update(user_id))
+        else:
+            await self.feed("text", text_update(user_id, rnd.choice(self.texts)))
+        # Кнопки привязаны к черновику — берём id того, что создал этот апдейт
+        created = [k for k in self.bm._user_drafts(user_id) if k not in before]
+        if not created:
+            self.errors += 1
+            return
+        draft = created[0][1]
+        await self.feed("regenerate", callback_update(user_id, self.button("regenerate", draft)))
+        await self.feed("style", callback_update(user_id, self.button("style", draft, rnd.choice(STYLES))))
+        await self.feed("publish", callback_update(user_id, self.button("publish", draft)))
+
+    async def run(self, users: int, rounds: int, seed: int) -> float:
+        async def user_loop(i: int):
+            rnd = random.Random(seed + i)
+            for _ in range(rounds):
+                await self.scenario(BASE_USER_ID + i, rnd)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_loop(i) for i in range(users)))
+        return time.perf_counter() - started
+
+
+def report(driver: Driver, elapsed: float, mem_growth: int, mem_peak: int,
+           telegram: FakeTelegram, openai: FakeOpenAI) -> None:
+    total = sum(len(v) for v in driver.latencies.values())
+    print(f"\n{'апдейт':<12}{'n':>6}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}{'max, ms':>10}")
+    for kind in ("text", "voice", "regenerate", "style", "publish"):
+        values = driver.latencies.get(kind)
+        if not values:
+            continue
+        row = [percentile(values, q) * 1000 for q in (0.5, 0.95, 0.99)] + [max(values) * 1000]
+        print(f"{kind:<12}{len(values):>6}" + "".join(f"{v:>10.0f}" for v in row))
+    print(f"\nапдейтов: {total} за {elapsed:.2f} с — {total / elapsed:.1f} апдейтов/с, ошибок: {driver.errors}")
+    print(f"память (tracemalloc): осталось после прогона {mem_growth / 1024:+.0f} КБ, пик {mem_peak / 1024:.0f} КБ")
+    print(f"черновиков в памяти: {len(driver.bm.SESSIONS)}, планировщик генераций: {driver.bm.scheduler.stats()}")
+    print(f"Bot API: {dict(telegram.calls)}")
+    print(f"OpenAI: {dict(openai.calls)}")
+    if driver.bm._openai_client is not None:
+        print(f"устойчивость OpenAI: {driver.bm._openai_client.resilience.stats()}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="виртуальных админов одновременно")
+    parser.add_argument("--rounds", type=int, default=2, help="сценариев на каждого админа")
+    parser.add_argument("--voice-share", type=float, default=0.25, help="доля сценариев с голосовым вместо текста")
+    parser.add_argument("--openai-latency", type=float, default=800, help="время ответа генерации, мс")
+    parser.add_argument("--stt-latency", type=float, default=1500, help="время распознавания, мс")
+    parser.add_argument("--stream-chunks", type=int, default=20, help="кусков в потоковом ответе")
+    parser.add_argument("--slow-share", type=float, default=0.0,
+                        help="доля медленных ответов генерации (хвост задержки)")
+    parser.add_argument("--slow-factor", type=float, default=10, help="во сколько раз медленнее такой ответ")
+    parser.add_argument("--error-share", type=float, default=0.0, help="доля ответов генерации с ошибкой 500")
+    parser.add_argument("--tg-latency", type=float, default=20, help="время ответа Bot API, мс")
+    parser.add_argument("--db", help="SQLite-файл черновиков (по умолчанию только память)")
+    parser.add_argument("--real-publish-limits", action="store_true",
+                        help="не поднимать PUBLISH_RATE_PER_MIN/PUBLISH_BURST для бенчмарка")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="оставить INFO-логи бота")
+    args = parser.parse_args()
+
+    telegram = FakeTelegram(latency_ms=args.tg_latency)
+    openai = FakeOpenAI(latency_ms=args.openai_latency, stt_latency_ms=args.stt_latency, chunks=args.stream_chunks,
+                        slow_share=args.slow_share, slow_factor=args.slow_factor, error_share=args.error_share)
+    setup_env(args, await telegram.start(), await openai.start())
+
+    started = time.perf_counter()
+    import bot as bot_module
+    print(f"импорт bot.py: {(time.perf_counter() - started) * 1000:.0f} ms")
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    bot_module.state_db.start()
+    driver = Driver(bot_module, load_corpus(), args.voice_share)
+    try:
+        # Прогон одним админом: ленивые импорты (openai, httpx) и соединения не попадают в замер
+        await driver.scenario(BASE_USER_ID - 1, random.Random(args.seed))
+        driver.latencies.clear()
+        telegram.calls.clear()
+        openai.calls.clear()
+
+        gc.collect()
+        # Считаются только выделения за время прогона: то, что осталось после gc, — рост памяти
+        tracemalloc.start()
+        elapsed = await driver.run(args.users, args.rounds, args.seed)
+        gc.collect()
+        mem_growth, mem_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"пользователей: {args.users}, сценариев: {args.users * args.rounds}, "
+              f"STREAM_POSTS={int(bot_module.STREAM_POSTS)}, OPENAI_CONCURRENCY={os.getenv('OPENAI_CONCURRENCY', '8')}")
+        report(driver, elapsed, mem_growth, mem_peak, telegram, openai)
+    finally:
+        await bot_module.state_db.close()
+        if bot_module._openai_client is not None:
+            await bot_module._openai_client.aclose()
+        await bot_module.bot.session.close()
+        await telegram.close()
+        await openai.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""Бенчмарк разбора дат в постах: dateparser на каждом вызове против быстрого пути с кэшем.
+
+Запуск из корня репозитория:
+    python bench/bench_time_parser.py [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import time_parser  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(__file__), "posts_corpus.txt")
+
+
+def load_corpus() -> list[str]:
+    with open(CORPUS, encoding="utf-8") as f:
+        return [p.strip() for p in f.read().split("\n---\n") if p.strip()]
+
+
+def bench(name: str, fn, posts: list[str], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for post in posts:
+            fn(post)
+    per_call = (time.perf_counter() - started) / (repeat * len(posts))
+    print(f"{name:<34} {per_call * 1000:9.3f} ms/пост")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    posts = load_corpus()
+    tz = ZoneInfo(os.getenv("TIMEZONE", "Europe/Moscow"))
+    now = datetime.now(tz)
+    normalized = [time_parser._normalize(p) for p in posts]
+    fast_hits = sum(1 for p in normalized if time_parser._fast_candidates(p, now))
+    print(f"Корпус: {len(posts)} постов, быстрый путь находит дату в {fast_hits}, остальные — через dateparser\n")
+
+    started = time.perf_counter()
+    time_parser._dateparser_candidates("завтра в 19:00", now)
+    print(f"{'первый вызов dateparser (загрузка)':<34} {(time.perf_counter() - started) * 1000:9.1f} ms")
+
+    legacy = bench("dateparser на каждый пост", lambda p: time_parser._dateparser_candidates(p, now), posts, args.repeat)
+    base_minute = int(now.timestamp() // 60)
+    fast = bench("быстрый путь без кэша",
+                 lambda p: time_parser._parse_cached.__wrapped__(time_parser._normalize(p), tz.key, base_minute),
+                 posts, args.repeat)
+    time_parser._parse_cached.cache_clear()
+    cached = bench("parse_event_datetime (с кэшем)", time_parser.parse_event_datetime, posts, args.repeat)
+    print(f"\nУскорение: быстрый путь ×{legacy / fast:.1f}, с кэшем ×{legacy / cached:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Локальные заглушки внешних API для бенчмарка: Bot API Telegram и OpenAI.
+
+Бот подключается к ним через переменные окружения TELEGRAM_API_URL и OPENAI_BASE_URL —
+код бота при этом тот же, что в проде, меняются только адреса.
+"""
+import abc
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+_POST = (
+    "🏁 Отличный вечер на трассе! Команда проехала гонку без ошибок в пит-стопах, "
+    "пилоты держали темп до самого финиша и привезли очки в зачёт. "
+    "Спасибо всем, кто болел в чате, — следующий этап уже через неделю."
+)
+
+
+class _FakeServer(abc.ABC):
+    def __init__(self, latency_ms: float, jitter: float = 0.2):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.calls: Counter = Counter()
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    @abc.abstractmethod
+    def _app(self) -> web.Application:
+        ...
+
+    async def _delay(self, seconds: Optional[float] = None) -> None:
+        base = self.latency if seconds is None else seconds
+        if base > 0:
+            await asyncio.sleep(base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def start(self) -> str:
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class FakeTelegram(_FakeServer):
+    """Bot API: любой метод отвечает успехом через latency_ms; отправки возвращают правдоподобное Message."""
+
+    def __init__(self, latency_ms: float = 20, file_bytes: int = 32 * 1024):
+        super().__init__(latency_ms)
+        self._file = bytes(file_bytes)
+        self._message_ids = itertools.count(1_000_000)
+
+    def _app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._download)
+        return app
+
+    def _message(self, params: dict) -> dict:
+        chat_id = params.get("chat_id", "0")
+        try:
+            chat_id = int(chat_id)
+        except ValueError:
+            pass
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id if isinstance(chat_id, int) else -100, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        await self._delay()
+        lowered = method.lower()
+        if lowered == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif lowered == "getfile":
+            result = {"file_id": params.get("file_id"), "file_unique_id": params.get("file_id"),
+                      "file_size": len(self._file), "file_path": f"voice/{params.get('file_id')}.ogg"}
+        elif lowered == "sendmediagroup":
+            media = json.loads(params.get("media", "[]"))
+            result = [self._message(params) for _ in media]
+        elif lowered.startswith(("send", "edit", "copy", "forward")):
+            result = self._message(params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _download(self, request: web.Request) -> web.Response:
+        self.calls["download"] += 1
+        await self._delay()
+        return web.Response(body=self._file, content_type="application/octet-stream")
+
+
+class FakeOpenAI(_FakeServer):
+    """OpenAI API: chat.completions (обычный и stream=True) и audio.transcriptions.
+
+    latency_ms — полное время ответа генерации; в потоке первый кусок приходит через ttft_share
+    от него, остальное делится между chunks кусками. Распознавание отвечает через stt_latency_ms.
+    Хвост и сбои: доля slow_share ответов генерации в slow_factor раз медленнее, доля error_share — 500."""
+
+    def __init__(self, latency_ms: float = 800, stt_latency_ms: float = 1500, chunks: int = 20,
+                 ttft_share: float = 0.3, slow_share: float = 0.0, slow_factor: float = 10,
+                 error_share: float = 0.0):
+        super().__init__(latency_ms)
+        self.stt_latency = stt_latency_ms / 1000
+        self.chunks = max(1, chunks)
+        self.ttft_share = ttft_share
+        self.slow_share = slow_share
+        self.slow_factor = slow_factor
+        self.error_share = error_share
+        self._ids = itertools.count(1)
+
+    def _app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self._chat)
+        app.router.add_post("/v1/audio/transcriptions", self._transcribe)
+        app.router.add_get("/v1/models/{model}", self._model)
+        return app
+
+    @staticmethod
+    def _usage(body: dict) -> dict:
+        # ~4 символа на токен — для метрик этого достаточно
+        prompt = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        completion = len(_POST) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get("model", "gpt-4o-mini")
+        common = {"id": f"chatcmpl-{next(self._ids)}", "created": int(time.time()), "model": model}
+        if random.random() < self.error_share:
+            self.calls["error"] += 1
+            await self._delay()
+            return web.json_response({"error": {"message": "bench: injected failure", "type": "server_error"}},
+                                     status=500)
+        latency = self.latency * (self.slow_factor if random.random() < self.slow_share else 1)
+        if not body.get("stream"):
+            self.calls["chat"] += 1
+            await self._delay(latency)
+            return web.json_response({
+                **common,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": _POST},
+                             "finish_reason": "stop"}],
+                "usage": self._usage(body),
+            })
+
+        self.calls["chat_stream"] += 1
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        await self._delay(latency * self.ttft_share)
+        step = -(-len(_POST) // self.chunks)
+        interval = latency * (1 - self.ttft_share) / self.chunks
+        for i in range(0, len(_POST), step):
+            chunk = {**common, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": _POST[i:i + step]}, "finish_reason": None}]}
+            await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await self._delay(interval)
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def _transcribe(self, request: web.Request) -> web.Response:
+        self.calls["transcribe"] += 1
+        await request.post()
+        await self._delay(self.stt_latency)
+        return web.Response(text="Сегодня финишировали третьими на Спа, завтра в 19:00 квалификация\n")
+
+    async def _model(self, request: web.Request) -> web.Response:
+        self.calls["models"] += 1
+        return web.json_response({"id": request.match_info["model"], "object": "model", "created": 0,
+                                  "owned_by": "bench"})
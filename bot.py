@@ -1,37 +1,215 @@
+import time
+
+_BOOT = time.perf_counter()  # отсчёт времени старта — до всех тяжёлых импортов
+
 import asyncio
+import importlib
 import logging
-import signal
-import sys
 import os
+from dataclasses import asdict
+from datetime import datetime
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable
+from zoneinfo import ZoneInfo
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command, StateFilter
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiohttp import web
 from dotenv import load_dotenv
-from openai_client import OpenAIClient
+from archive import PostArchive
+from batch_items import parse_upload, split_text
+from gen_cache import make_key
+from gen_scheduler import GenerationScheduler, Superseded
+from media import CAPTION_LIMIT, MediaCollector, MediaItem, caption_fits, check_group
+from metrics import REGISTRY
+from publish_queue import Job, PublishQueue
+from publisher import PublishError, Publisher, build_plan, publish_key
+from server import (
+    HandlerMetrics, InflightTracker, add_metrics_route, run_polling, run_webhook, start_metrics_server, stop_event,
+)
+from session_store import FSMStore, Session, SessionStore, StateDB, new_draft_id
+from startup import StartupTimer, warm_up
+import time_parser
 from time_parser import parse_event_datetime, format_dt_ru
 
+if TYPE_CHECKING:
+    from openai_client import CallStats, OpenAIClient
+
+startup_timer = StartupTimer(_BOOT)
+startup_timer.mark('imports')
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Свой сервер Bot API: локальный telegram-bot-api или заглушка бенчмарка (bench/bench_bot.py)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
 CHANNEL_ID_RAW = os.getenv('TELEGRAM_CHANNEL_ID')  # @channel_username или числовой id
+CHANNEL_IDS_RAW = os.getenv('TELEGRAM_CHANNEL_IDS', '')  # запятая: @main,-100123,@sponsor (вместо TELEGRAM_CHANNEL_ID)
 ADMIN_IDS_RAW = os.getenv('ADMIN_USER_IDS', '')  # запятая: 12345,67890
 ADMIN_USERNAMES_RAW = os.getenv('ADMIN_USERNAMES', '')  # запятая: user1,user2 (без @)
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный https-адрес; пусто — вебхук в Telegram не регистрируется
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+# Выбросить апдейты, накопившиеся, пока бот был выключен (по умолчанию — обработать)
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', '0') == '1'
+# Сколько секунд при остановке ждать уже начатые обработчики
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '60'))
+# Фоновый прогрев после старта: клиент OpenAI + соединение, dateparser (WARM_UP=0 — выключить)
+WARM_UP = os.getenv('WARM_UP', '1') != '0'
+# Метрики Prometheus: отдельный порт (по умолчанию только на 127.0.0.1); без него — только сводка /stats.
+# METRICS_ON_WEBHOOK=1 — отдавать /metrics на публичном порту вебхука (без авторизации, включать осознанно)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+METRICS_ON_WEBHOOK = os.getenv('METRICS_ON_WEBHOOK', '0') == '1'
 if not BOT_TOKEN:
     raise RuntimeError('TELEGRAM_BOT_TOKEN is not set in .env')
-
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
-openai_client = OpenAIClient()
-
-# Простейшее хранилище сессий в памяти
-SESSIONS: dict[int, dict] = {}
+# Клиент OpenAI создаётся лениво, но без ключа бот бесполезен — проверяем сразу
+if not os.getenv('OPENAI_API_KEY'):
+    raise RuntimeError('OPENAI_API_KEY is not set in .env')
+
+# Черновики и FSM: в памяти с вытеснением по TTL + SQLite-файл, чтобы пережить рестарт (пусто — только память)
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'bot_state.sqlite3')
+SESSION_TTL_HOURS = float(os.getenv('SESSION_TTL_HOURS', '72'))
+startup_timer.mark('config')
+state_db = StateDB(SESSION_DB_PATH or None, flush_interval=float(os.getenv('SESSION_FLUSH_INTERVAL', '2')))
+
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+)
+dp = Dispatcher(storage=FSMStore(ttl=SESSION_TTL_HOURS * 3600, db=state_db))
+inflight = InflightTracker()
+dp.update.outer_middleware(inflight)
+
+HANDLER_SECONDS = REGISTRY.histogram('bot_handler_seconds', 'Handler duration', ('handler', 'status'))
+OPENAI_SECONDS = REGISTRY.histogram('openai_request_seconds', 'OpenAI request duration', ('kind', 'model', 'status'))
+OPENAI_TOKENS = REGISTRY.counter('openai_tokens_total', 'OpenAI tokens used', ('kind', 'model', 'direction'))
+STT_SPEED = REGISTRY.histogram(
+    'openai_transcribe_seconds_per_audio_second', 'Transcription time per second of audio', ('model',),
+    buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2),
+)
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram(
+    'telegram_send_seconds', 'Publish send duration incl. retries', ('method', 'status'),
+)
+TELEGRAM_SEND_ATTEMPTS = REGISTRY.counter('telegram_send_attempts_total', 'Publish send attempts', ('method',))
+
+handler_metrics = HandlerMetrics(HANDLER_SECONDS)
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+
+
+def _record_openai_call(stats: 'CallStats'):
+    status = stats.error or 'ok'
+    OPENAI_SECONDS.observe(stats.duration, kind=stats.kind, model=stats.model, status=status)
+    if stats.prompt_tokens is not None:
+        OPENAI_TOKENS.inc(stats.prompt_tokens, kind=stats.kind, model=stats.model, direction='in')
+    if stats.completion_tokens is not None:
+        OPENAI_TOKENS.inc(stats.completion_tokens, kind=stats.kind, model=stats.model, direction='out')
+    if stats.audio_seconds and not stats.error:
+        STT_SPEED.observe(stats.duration / stats.audio_seconds, model=stats.model)
+
+
+def _record_send(method: str, latency: float, attempts: int, error: BaseException | None):
+    TELEGRAM_SEND_SECONDS.observe(latency, method=method, status=type(error).__name__ if error else 'ok')
+    TELEGRAM_SEND_ATTEMPTS.inc(attempts, method=method)
+
+
+publisher = Publisher(
+    bot,
+    per_chat_per_min=float(os.getenv('PUBLISH_RATE_PER_MIN', '20')),
+    burst=int(os.getenv('PUBLISH_BURST', '5')),
+    on_send=_record_send,
+)
+# Все запросы к OpenAI: общий лимит параллельных вызовов, один запрос на админа, склейка одинаковых
+scheduler = GenerationScheduler(max_concurrent=int(os.getenv('OPENAI_CONCURRENCY', '8')))
+REGISTRY.gauge('bot_updates_inflight', 'Updates being processed', lambda: inflight.inflight)
+REGISTRY.gauge('openai_calls_inflight', 'OpenAI calls running or queued', lambda: scheduler.stats()['inflight'])
+REGISTRY.gauge('openai_calls_queued', 'OpenAI calls waiting for a free slot', lambda: scheduler.queued)
+REGISTRY.gauge(
+    'openai_circuits_open', 'Models switched off by the circuit breaker',
+    lambda: _openai_client.resilience.open_circuits() if _openai_client else 0,
+)
+
+# Черновики: ключ (user_id, draft) — у админа их может быть несколько одновременно
+SESSIONS = SessionStore(ttl=SESSION_TTL_HOURS * 3600, db=state_db)
+for _key in SESSIONS:
+    # Черновики прежнего формата лежали под ключом user_id — делаем из них обычные черновики
+    if isinstance(_key, int):
+        SESSIONS[(_key, new_draft_id())] = SESSIONS.pop(_key)
+REGISTRY.gauge('bot_sessions', 'Drafts in memory', lambda: len(SESSIONS))
 MAX_IMAGES = int(os.getenv('MAX_IMAGES', '3'))
+# Альбом приходит отдельными апдейтами: ждём паузу MEDIA_DEBOUNCE_MS и отвечаем один раз на всю пачку
+MEDIA_COLLECTOR = MediaCollector(debounce=int(os.getenv('MEDIA_DEBOUNCE_MS', '600')) / 1000)
+# Потоковая генерация: текст появляется в сообщении по мере генерации
+STREAM_POSTS = os.getenv('STREAM_POSTS', '1') != '0'
+# Не чаще одной правки сообщения за интервал (сек) — иначе Telegram ответит 429
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.2'))
+# Предгенерация всех стилей при открытии меню «Перегенерировать» (по умолчанию выключена)
+PREFETCH_STYLES = os.getenv('PREFETCH_STYLES', '0') == '1'
+# Потолок токенов на предгенерацию за сессию и на один черновик
+PREFETCH_TOKEN_BUDGET = int(os.getenv('PREFETCH_TOKEN_BUDGET', '4000'))
+PREFETCH_MAX_TOKENS = int(os.getenv('PREFETCH_MAX_TOKENS', '600'))
+STYLES = ('classic', 'funny', 'report')
+# Лимит размера голосовых/аудио для распознавания (Bot API отдаёт ботам файлы до 20 МБ)
+MAX_AUDIO_MB = float(os.getenv('MAX_AUDIO_MB', '20'))
+# Начиная с какой длительности (сек) или размера (МБ) аудио распознаётся по частям параллельно
+LONG_AUDIO_SECONDS = int(os.getenv('LONG_AUDIO_SECONDS', '600'))
+LONG_AUDIO_MB = float(os.getenv('LONG_AUDIO_MB', '15'))
+# Пакетный режим (/batch): сколько пунктов за раз, сколько из них генерируется параллельно,
+# интервал публикации «по одному» и лимит размера загружаемого .txt/.csv
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '20'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '6'))
+BATCH_INTERVAL_MINUTES = float(os.getenv('BATCH_INTERVAL_MINUTES', '30'))
+BATCH_MAX_FILE_KB = int(os.getenv('BATCH_MAX_FILE_KB', '256'))
+# Отложенные публикации: задания в SQLite (по умолчанию — в файле черновиков); задания, пропущенные
+# дольше SCHEDULE_MAX_LATE_HOURS (бот был выключен), не публикуются — автор получает текст обратно
+SCHEDULE_DB_PATH = os.getenv('SCHEDULE_DB_PATH', SESSION_DB_PATH)
+SCHEDULE_MAX_LATE_HOURS = float(os.getenv('SCHEDULE_MAX_LATE_HOURS', '6'))
+TZ = ZoneInfo(os.getenv('TIMEZONE', 'Europe/Moscow'))
+publish_queue = PublishQueue(SCHEDULE_DB_PATH or None, max_late=SCHEDULE_MAX_LATE_HOURS * 3600)
+REGISTRY.gauge('scheduled_posts', 'Posts waiting in the publish queue', lambda: len(publish_queue))
+# Архив опубликованного (по умолчанию — в файле черновиков): поиск /search и предупреждение о повторе
+ARCHIVE_DB_PATH = os.getenv('ARCHIVE_DB_PATH', SESSION_DB_PATH)
+archive = PostArchive(
+    ARCHIVE_DB_PATH or None,
+    dup_threshold=float(os.getenv('ARCHIVE_DUP_THRESHOLD', '0.6')),
+    dup_days=float(os.getenv('ARCHIVE_DUP_DAYS', '30')),
+)
+SEARCH_PAGE_SIZE = 5
+# Последний запрос /search каждого админа — текст запроса не помещается в callback_data
+_last_search: dict[int, str] = {}
+# Ключи идущих публикаций: кто присоединился к уже идущей, тот пост в архив не пишет
+_publishing: set[str] = set()
+# Незавершённые предгенерации: (user_id, draft) → {style: Task}. Задачи живут только в памяти, не в сессии
+PREFETCH_TASKS: dict[tuple, dict[str, asyncio.Task]] = {}
+startup_timer.mark('storage')
+
+_openai_client: 'OpenAIClient | None' = None
+_warm_up_task: asyncio.Task | None = None
+
+
+def get_openai() -> 'OpenAIClient':
+    """Клиент OpenAI: модуль (openai + httpx) импортируется при первом обращении —
+    обычно его раньше успевает сделать фоновый прогрев, а не первый пользователь."""
+    global _openai_client
+    if _openai_client is None:
+        from openai_client import OpenAIClient
+        _openai_client = OpenAIClient()
+        _openai_client.on_call = _record_openai_call
+    return _openai_client
 
 # Разбор админов из .env
 def _parse_admin_ids(raw: str) -> set[int]:
@@ -53,8 +231,25 @@ def _parse_admin_usernames(raw: str) -> set[str]:
             names.add(uname)
     return names
 
+def _parse_chat_ids(raw: str) -> list[int | str]:
+    chat_ids: list[int | str] = []
+    for part in (raw or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            chat_id: int | str = int(part)
+        except ValueError:
+            chat_id = part  # @username
+        if chat_id not in chat_ids:
+            chat_ids.append(chat_id)
+    return chat_ids
+
 ADMIN_IDS = _parse_admin_ids(ADMIN_IDS_RAW)
 ADMIN_USERNAMES = _parse_admin_usernames(ADMIN_USERNAMES_RAW)
+# Каналы для публикации разбираем один раз при старте
+CHANNEL_IDS = _parse_chat_ids(CHANNEL_IDS_RAW or CHANNEL_ID_RAW)
+PUBLISH_CONCURRENCY = int(os.getenv('PUBLISH_CONCURRENCY', '4'))
 
 def is_admin_user(user: types.User) -> bool:
     # Если список админов пуст — разрешаем всем (для удобства разработки)
@@ -81,34 +276,134 @@ async def guard_callback(callback: types.CallbackQuery) -> bool:
 class PostStates(StatesGroup):
     waiting_for_edit = State()
     waiting_for_media = State()
+    waiting_for_schedule = State()
+
+
+class BatchStates(StatesGroup):
+    waiting_for_items = State()
+
 
+class DraftCb(CallbackData, prefix='d'):
+    """Кнопка черновика: действие, id черновика и аргумент (например, стиль)."""
+    action: str
+    draft: int
+    arg: str | None = None  # пустое поле aiogram распаковывает как None
 
-def get_main_keyboard() -> InlineKeyboardMarkup:
+
+class BatchCb(CallbackData, prefix='b'):
+    action: str
+    n: int = 0
+
+
+class JobCb(CallbackData, prefix='job'):
+    id: int
+
+
+class SearchCb(CallbackData, prefix='s'):
+    action: str  # page | open
+    page: int = 0
+    id: int = 0
+
+
+def _draft_button(text: str, action: str, draft: int, arg: str | None = None) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=DraftCb(action=action, draft=draft, arg=arg).pack())
+
+
+def _batch_button(text: str, action: str, n: int = 0) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=BatchCb(action=action, n=n).pack())
+
+
+def get_main_keyboard(draft: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔁 Перегенерировать", callback_data="regenerate")],
-        [InlineKeyboardButton(text="📝 Редактировать", callback_data="edit")],
-        [InlineKeyboardButton(text="📎 Прикрепить медиа", callback_data="add_media")],
-        [InlineKeyboardButton(text="📤 Опубликовать", callback_data="publish")],
-        [InlineKeyboardButton(text="❌ Отменить", callback_data="cancel")],
+        [_draft_button("🔁 Перегенерировать", 'regenerate', draft)],
+        [_draft_button("📝 Редактировать", 'edit', draft)],
+        [_draft_button("📎 Прикрепить медиа", 'add_media', draft)],
+        [_draft_button("📤 Опубликовать", 'publish', draft)],
+        [_draft_button("🕒 Запланировать", 'schedule', draft)],
+        [_draft_button("❌ Отменить", 'cancel', draft)],
     ])
 
 
-def get_style_keyboard() -> InlineKeyboardMarkup:
+def get_style_keyboard(draft: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏁 Классический", callback_data="style_classic")],
-        [InlineKeyboardButton(text="😄 Шуточный", callback_data="style_funny")],
-        [InlineKeyboardButton(text="📊 Репортаж", callback_data="style_report")],
-        [InlineKeyboardButton(text="↩️ Назад", callback_data="back_main")],
+        [_draft_button("🏁 Классический", 'style', draft, 'classic')],
+        [_draft_button("😄 Шуточный", 'style', draft, 'funny')],
+        [_draft_button("📊 Репортаж", 'style', draft, 'report')],
+        [_draft_button("↩️ Назад", 'back', draft)],
     ])
 
 
-def get_media_keyboard() -> InlineKeyboardMarkup:
+def get_media_keyboard(draft: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Готово", callback_data="media_done")],
-        [InlineKeyboardButton(text="❌ Отменить", callback_data="cancel")],
+        [_draft_button("✅ Готово", 'media_done', draft)],
+        [_draft_button("❌ Отменить", 'cancel', draft)],
     ])
 
 
+# Кнопки разбираются через таблицы действий: DraftCb/BatchCb.action → обработчик.
+# Один обработчик на семейство кнопок вместо цепочки фильтров по строкам callback_data
+DraftAction = Callable[[types.CallbackQuery, FSMContext, tuple, Session, str | None], Awaitable[None]]
+BatchAction = Callable[[types.CallbackQuery, BatchCb], Awaitable[None]]
+DRAFT_ACTIONS: dict[str, DraftAction] = {}
+BATCH_ACTIONS: dict[str, BatchAction] = {}
+
+
+def _registrar(table: dict):
+    def action(*names: str):
+        def register(fn):
+            for name in names:
+                table[name] = fn
+            return fn
+        return register
+    return action
+
+
+draft_action = _registrar(DRAFT_ACTIONS)
+batch_action = _registrar(BATCH_ACTIONS)
+
+
+@dp.callback_query(DraftCb.filter())
+async def route_draft(callback: types.CallbackQuery, callback_data: DraftCb, state: FSMContext):
+    if not await guard_callback(callback):
+        return
+    action = DRAFT_ACTIONS.get(callback_data.action)
+    key = (callback.from_user.id, callback_data.draft)
+    sess = SESSIONS.get(key)
+    if action is None or sess is None:
+        await callback.answer("Черновик не найден: он опубликован, отменён или устарел. Список — /drafts",
+                              show_alert=True)
+        return
+    await action(callback, state, key, sess, callback_data.arg)
+
+
+@dp.callback_query(BatchCb.filter())
+async def route_batch(callback: types.CallbackQuery, callback_data: BatchCb):
+    if not await guard_callback(callback):
+        return
+    action = BATCH_ACTIONS.get(callback_data.action)
+    if action is None:
+        await callback.answer()
+        return
+    await action(callback, callback_data)
+
+
+def _user_drafts(user_id: int) -> list[tuple]:
+    # Ключи черновиков админа по времени создания; ключи пакета (user_id, 'batch', n) сюда не входят
+    return sorted(k for k in SESSIONS if isinstance(k, tuple) and len(k) == 2 and k[0] == user_id and k in SESSIONS)
+
+
+async def _state_draft(message: types.Message, state: FSMContext) -> tuple[tuple, Session] | None:
+    """Черновик текущего шага FSM (правка, медиа, время публикации): его id лежит в данных состояния."""
+    data = await state.get_data()
+    key = (message.from_user.id, data.get('draft'))
+    sess = SESSIONS.get(key)
+    if sess is None:
+        await state.clear()
+        await message.answer("Черновик не найден. Отправьте текст заново.")
+        return None
+    return key, sess
+
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     if not await guard_message(message):
@@ -123,6 +418,121 @@ async def cmd_help(message: types.Message):
     await message.answer("Отправьте любой текст — я повторю его. Это Шаг 1 из 5.")
 
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    if not await guard_message(message):
+        return
+    summary = REGISTRY.summary() or 'Пока нет данных.'
+    # Сводка считается из тех же счётчиков, что и /metrics, — без запросов наружу
+    await message.answer(f"📈 Метрики с момента запуска:\n{summary}"[:4096])
+
+
+@dp.message(Command("batch"))
+async def cmd_batch(message: types.Message, state: FSMContext, command: CommandObject):
+    if not await guard_message(message):
+        return
+    # Пункты можно прислать сразу после команды, в том же сообщении
+    if command.args:
+        await _start_batch(message, state, split_text(command.args))
+        return
+    await state.set_state(BatchStates.waiting_for_items)
+    replace_hint = "\nТекущий пакет будет заменён." if _batch_keys(message.from_user.id) else ""
+    await message.answer(
+        "📚 Пакетный режим: пришлите текст, где пункты разделены строкой «---» или пустой строкой, "
+        f"либо файл .txt/.csv (в CSV каждая строка — пункт). До {BATCH_MAX_ITEMS} пунктов.{replace_hint}"
+    )
+
+
+@dp.message(Command("scheduled"))
+async def cmd_scheduled(message: types.Message):
+    if not await guard_message(message):
+        return
+    jobs = publish_queue.pending(message.from_user.id)
+    if not jobs:
+        await message.answer("🕒 Запланированных постов нет.")
+        return
+    lines = [f"🕒 Запланировано: {len(jobs)}"]
+    buttons = []
+    for i, job in enumerate(jobs, 1):
+        preview = Session.from_json(job.payload).post_text.replace('\n', ' ')
+        lines.append(f"{i}. {_format_due(job)} — {preview[:60]}{'…' if len(preview) > 60 else ''}")
+        if len(buttons) < 20:
+            buttons.append([InlineKeyboardButton(text=f"❌ Отменить №{i}", callback_data=JobCb(id=job.id).pack())])
+    await message.answer("\n".join(lines)[:4096], reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+
+@dp.message(Command("drafts"))
+async def cmd_drafts(message: types.Message):
+    if not await guard_message(message):
+        return
+    keys = _user_drafts(message.from_user.id)
+    if not keys:
+        await message.answer("📝 Черновиков нет. Отправьте текст — появится новый.")
+        return
+    lines = [f"📝 Черновики: {len(keys)}"]
+    buttons = []
+    for i, key in enumerate(keys, 1):
+        preview = SESSIONS[key].post_text.replace('\n', ' ')
+        lines.append(f"{i}. {preview[:60]}{'…' if len(preview) > 60 else ''}")
+        if len(buttons) < 20:
+            buttons.append([_draft_button(f"📝 Открыть №{i}", 'show', key[1])])
+    await message.answer("\n".join(lines)[:4096], reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+
+def _search_page(user_id: int, page: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    query = _last_search.get(user_id, '')
+    total, posts = archive.search(query, limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE)
+    if not total:
+        return f"🔎 По запросу «{query}» ничего не найдено.", None
+    pages = -(-total // SEARCH_PAGE_SIZE)
+    lines = [f"🔎 «{query}»: найдено {total}, страница {page + 1}/{pages}"]
+    rows = []
+    for i, post in enumerate(posts, page * SEARCH_PAGE_SIZE + 1):
+        when = format_dt_ru(datetime.fromtimestamp(post.published_at, TZ))
+        snippet = (post.snippet or post.post_text).replace('\n', ' ')
+        lines.append(f"{i}. {when}{f' · {post.style}' if post.style else ''}\n{snippet}")
+        rows.append(InlineKeyboardButton(text=f"📄 {i}", callback_data=SearchCb(action='open', id=post.id).pack()))
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=SearchCb(action='page', page=page - 1).pack()))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=SearchCb(action='page', page=page + 1).pack()))
+    keyboard = [rows] + ([nav] if nav else [])
+    return "\n\n".join(lines)[:4096], InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject):
+    if not await guard_message(message):
+        return
+    if not command.args:
+        await message.answer(f"🔎 Поиск по опубликованным постам ({len(archive)} в архиве): /search <слова>")
+        return
+    _last_search[message.from_user.id] = command.args.strip()
+    text, keyboard = _search_page(message.from_user.id, 0)
+    await message.answer(text, reply_markup=keyboard)
+
+
+@dp.callback_query(SearchCb.filter())
+async def handle_search_button(callback: types.CallbackQuery, callback_data: SearchCb):
+    if not await guard_callback(callback):
+        return
+    if callback_data.action == 'open':
+        post = archive.get(callback_data.id)
+        if post is None:
+            await callback.answer("Пост не найден в архиве.", show_alert=True)
+            return
+        await callback.answer()
+        await callback.message.answer(post.post_text[:4096])
+        return
+    if callback.from_user.id not in _last_search:
+        await callback.answer("Поиск устарел — повторите /search", show_alert=True)
+        return
+    text, keyboard = _search_page(callback.from_user.id, callback_data.page)
+    await callback.answer()
+    await _safe_edit(callback.message, text, reply_markup=keyboard)
+
+
 # Обрабатываем обычный текст только вне состояний (state=None), чтобы не перехватывать редактирование
 @dp.message(StateFilter(None), F.text)
 async def generate_post(message: types.Message, state: FSMContext):
@@ -141,24 +551,84 @@ def _detect_verbosity(text: str) -> str:
     return "long"
 
 
+async def _safe_edit(msg: types.Message, text: str, reply_markup: InlineKeyboardMarkup | None = None):
+    try:
+        await msg.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        # «message is not modified» — текст не изменился с прошлой правки, это не ошибка
+        if 'not modified' not in str(e):
+            raise
+
+
+async def _stream_to_message(placeholder: types.Message, chunks: AsyncIterator[str]) -> tuple[str, float]:
+    """Правит placeholder по мере прихода кусочков текста (с троттлингом). Возвращает итоговый текст
+    и момент (loop.time()), раньше которого следующую правку делать нельзя."""
+    loop = asyncio.get_running_loop()
+    text = ''
+    shown = ''
+    next_edit_at = 0.0
+    async for delta in chunks:
+        text += delta
+        now = loop.time()
+        if now < next_edit_at or text.strip() == shown:
+            continue
+        shown = text.strip()
+        try:
+            await _safe_edit(placeholder, f"{shown} ▌")
+            next_edit_at = now + STREAM_EDIT_INTERVAL
+        except TelegramRetryAfter as e:
+            # Промежуточные правки не критичны — просто пропускаем их до конца flood-wait
+            next_edit_at = now + e.retry_after
+    return text.strip(), next_edit_at
+
+
+async def _finish_stream(placeholder: types.Message, text: str, reply_markup: InlineKeyboardMarkup,
+                         not_before: float) -> None:
+    """Финальная правка после потока. Ждёт конца троттлинга, flood-wait переживает одним повтором;
+    если правка так и не прошла — присылает пост новым сообщением: без клавиатуры черновиком не управлять."""
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.sleep(max(0.0, not_before - loop.time()))
+        try:
+            await _safe_edit(placeholder, text, reply_markup=reply_markup)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            await _safe_edit(placeholder, text, reply_markup=reply_markup)
+        return
+    except Exception as e:
+        logger.warning("Final edit of streamed post failed (%s), sending it as a new message", e)
+    await placeholder.answer(text, reply_markup=reply_markup)
+
+
 async def handle_text_to_post(message: types.Message, state: FSMContext, input_text: str):
     if not input_text:
         await message.answer("Отправьте текст.")
         return
-    await message.answer("🤖 Генерирую пост…")
+    # Каждый текст — новый черновик: предыдущие остаются в работе со своими кнопками
+    draft_key = (message.from_user.id, new_draft_id())
+    placeholder = await message.answer("🤖 Генерирую пост…")
     try:
         # Не добавляем явные даты во вход — пусть модель не вставляет таймштампы
         verbosity = _detect_verbosity(input_text)
-        post = openai_client.generate_post_from_text(input_text, verbosity=verbosity)
+        # Владелец запроса — черновик: генерации разных черновиков идут параллельно и не вытесняют друг друга
+        key = make_key(kind='post', text=input_text, verbosity=verbosity)
+        if STREAM_POSTS:
+            post, next_edit_at = await _stream_to_message(placeholder, scheduler.stream(
+                draft_key, key, lambda: get_openai().stream_post_from_text(input_text, verbosity=verbosity),
+            ))
+        else:
+            post = await scheduler.run(
+                draft_key, key, lambda: get_openai().generate_post_from_text(input_text, verbosity=verbosity),
+            )
         if not post:
             await message.answer("❌ Не удалось сгенерировать пост.")
             return
-        SESSIONS[message.from_user.id] = {
-            'original_text': input_text,
-            'post_text': post,
-            'media': [],
-        }
-        await message.answer(post, reply_markup=get_main_keyboard())
+        SESSIONS[draft_key] = Session(original_text=input_text, post_text=post)
+        if STREAM_POSTS:
+            # Клавиатуру добавляем только финальной правкой, когда текст готов
+            await _finish_stream(placeholder, post, get_main_keyboard(draft_key[1]), next_edit_at)
+        else:
+            await message.answer(post, reply_markup=get_main_keyboard(draft_key[1]))
     except Exception as e:
         await message.answer(f"❌ Ошибка генерации: {e}")
 
@@ -173,7 +643,9 @@ async def handle_media_anytime(message: types.Message, state: FSMContext):
     if current_state == PostStates.waiting_for_media.state:
         await handle_media_upload(message, state)
         return
-    # Иначе просим нажать кнопку
+    # Иначе просим нажать кнопку — один раз на альбом, а не на каждый его файл
+    if await MEDIA_COLLECTOR.collect(('hint', message.chat.id, message.from_user.id), message.message_id) is None:
+        return
     await message.answer("Чтобы добавить медиа к посту, нажмите кнопку «Прикрепить медиа».")
 
 
@@ -187,21 +659,25 @@ async def handle_voice_to_text(message: types.Message, state: FSMContext):
         await handle_media_upload(message, state)
         return
 
+    audio = message.voice or message.audio
+    # Проверяем размер по метаданным до скачивания — большие файлы даже не тянем
+    if audio.file_size and audio.file_size > MAX_AUDIO_MB * 1024 * 1024:
+        await message.answer(f"⚠️ Файл слишком большой ({audio.file_size / 1024 / 1024:.1f} МБ). Лимит — {MAX_AUDIO_MB:g} МБ.")
+        return
+
     await message.answer("🎙️ Распознаю голос…")
     try:
-        if message.voice:
-            file_id = message.voice.file_id
-            file_info = await bot.get_file(file_id)
-            file = await bot.download_file(file_info.file_path)
-            audio_bytes = file.read()
-            text = openai_client.transcribe(audio_bytes, filename="voice.ogg", language="ru")
+        # используем имя для подсказки формата
+        filename = "voice.ogg" if message.voice else (message.audio.file_name or "audio.mp3")
+        # BytesIO из загрузки отдаём в Whisper напрямую: без .read() в bytes и без временного файла
+        buffer = await bot.download(audio.file_id)
+        is_long = (audio.duration or 0) > LONG_AUDIO_SECONDS or (audio.file_size or 0) > LONG_AUDIO_MB * 1024 * 1024
+        if is_long and audio.duration:
+            transcribe = lambda: get_openai().transcribe_long(buffer, audio.duration, filename=filename, language="ru")
         else:
-            file_id = message.audio.file_id
-            file_info = await bot.get_file(file_id)
-            file = await bot.download_file(file_info.file_path)
-            audio_bytes = file.read()
-            # используем имя для подсказки формата
-            text = openai_client.transcribe(audio_bytes, filename=(message.audio.file_name or "audio.mp3"), language="ru")
+            transcribe = lambda: get_openai().transcribe((filename, buffer), language="ru", duration=audio.duration)
+        # Один и тот же файл (например, пересланный дважды) распознаётся одним запросом
+        text = await scheduler.run(None, make_key(kind='stt', file=audio.file_unique_id), transcribe)
 
         if not text:
             await message.answer("❌ Не удалось распознать голос. Попробуйте ещё раз.")
@@ -213,44 +689,122 @@ async def handle_voice_to_text(message: types.Message, state: FSMContext):
         await message.answer(f"❌ Ошибка распознавания: {e}")
 
 
-@dp.callback_query(lambda c: c.data == 'regenerate')
-async def handle_regenerate(callback: types.CallbackQuery):
-    if not await guard_callback(callback):
-        return
-    await callback.message.edit_text("🎨 Выберите стиль:", reply_markup=get_style_keyboard())
+def _estimate_tokens(text: str) -> int:
+    # Грубая оценка для бюджета: ~2 символа кириллицы на токен + системный промпт
+    return len(text or '') // 2 + 150
 
 
-@dp.callback_query(lambda c: c.data.startswith('style_'))
-async def handle_style(callback: types.CallbackQuery):
-    if not await guard_callback(callback):
-        return
-    user_id = callback.from_user.id
-    sess = SESSIONS.get(user_id)
-    if not sess:
-        await callback.answer("Сессия не найдена. Отправьте текст заново.", show_alert=True)
-        return
-    style = callback.data.split('_', 1)[1]
-    await callback.message.edit_text("🤖 Генерирую пост в выбранном стиле…")
-    text_source = sess.get('original_text') or sess.get('post_text', '')
-    # Сохраняем длину от исходного запроса, если есть; иначе — от текущего поста
-    seed_text = sess.get('original_text') or text_source
-    verbosity = _detect_verbosity(seed_text)
-    new_post = openai_client.generate_post_in_style(text_source, style, verbosity=verbosity)
-    sess['post_text'] = new_post
-    await callback.message.edit_text(new_post, reply_markup=get_main_keyboard())
-
-
-@dp.callback_query(lambda c: c.data == 'edit')
-async def handle_edit(callback: types.CallbackQuery, state: FSMContext):
-    if not await guard_callback(callback):
-        return
+def _style_key(text: str, style: str, verbosity: str, fresh: bool) -> str:
+    # Без max_tokens: выбор стиля присоединяется к уже идущей предгенерации того же стиля
+    return make_key(kind='style', text=text, style=style, verbosity=verbosity, fresh=fresh)
+
+
+async def _prefetch_style(key: tuple, sess: Session, style: str, text: str, verbosity: str) -> str:
+    def add_usage(tokens: int):
+        sess.prefetch_tokens += tokens
+
+    fresh = style == sess.style
+    post = await scheduler.run(
+        None, _style_key(text, style, verbosity, fresh),
+        lambda: get_openai().generate_post_in_style(
+            text, style, verbosity=verbosity, max_tokens=PREFETCH_MAX_TOKENS, on_usage=add_usage, force_fresh=fresh,
+        ),
+    )
+    # Если этот же вызов уже забрал выбор стиля и текст стал текущим — черновик не нужен
+    if post and post != sess.post_text:
+        sess.style_drafts[style] = post
+        SESSIONS.touch(key)
+    return post
+
+
+def _start_prefetch(key: tuple, sess: Session):
+    """Параллельно запускает генерацию всех стилей, пока пользователь выбирает, — в пределах бюджета токенов."""
+    text_source = sess.original_text or sess.post_text
+    verbosity = _detect_verbosity(text_source)
+    drafts = sess.style_drafts
+    tasks = PREFETCH_TASKS.setdefault(key, {})
+    # Резервируем худший случай на каждый запуск: промпт + PREFETCH_MAX_TOKENS ответа
+    per_call = _estimate_tokens(text_source) + PREFETCH_MAX_TOKENS
+    for style in STYLES:
+        if style in drafts or style in tasks:
+            continue
+        if sess.prefetch_tokens + per_call * (len(tasks) + 1) > PREFETCH_TOKEN_BUDGET:
+            logger.info("Prefetch budget exhausted for draft %s", key)
+            break
+        task = asyncio.create_task(_prefetch_style(key, sess, style, text_source, verbosity))
+        tasks[style] = task
+        task.add_done_callback(lambda t, style=style: _on_prefetch_done(key, style, t))
+
+
+def _on_prefetch_done(key: tuple, style: str, task: asyncio.Task):
+    tasks = PREFETCH_TASKS.get(key)
+    if tasks and tasks.get(style) is task:
+        del tasks[style]
+        if not tasks:
+            PREFETCH_TASKS.pop(key, None)
+    if not task.cancelled() and task.exception():
+        logger.warning("Prefetch %s failed for draft %s: %s", style, key, task.exception())
+
+
+def _cancel_prefetch(key: tuple):
+    for task in PREFETCH_TASKS.pop(key, {}).values():
+        task.cancel()
+
+
+@draft_action('regenerate')
+async def handle_regenerate(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
+    await callback.message.edit_text("🎨 Выберите стиль:", reply_markup=get_style_keyboard(key[1]))
+    if PREFETCH_STYLES:
+        _start_prefetch(key, sess)
+
+
+@draft_action('show')
+async def handle_show_draft(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
+    await callback.message.answer(sess.post_text or sess.original_text, reply_markup=get_main_keyboard(key[1]))
+    await callback.answer()
+
+
+@draft_action('style')
+async def handle_style(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, style: str | None):
+    drafts = sess.style_drafts
+    # Черновик из предгенерации используем один раз: повторный выбор стиля даёт новый вариант
+    new_post = drafts.pop(style, None)
+    if new_post is None:
+        await callback.message.edit_text("🤖 Генерирую пост в выбранном стиле…")
+        text_source = sess.original_text or sess.post_text
+        # Сохраняем длину от исходного запроса, если есть; иначе — от текущего поста
+        seed_text = sess.original_text or text_source
+        verbosity = _detect_verbosity(seed_text)
+        # Повторный выбор того же стиля — явная просьба о новом варианте, кэш не используем
+        fresh = style == sess.style
+        # Идущая предгенерация этого стиля не дублируется: запрос присоединяется к ней.
+        # Нажатие другого стиля того же черновика, пока этот генерируется, вытесняет его — побеждает последний выбор
+        try:
+            new_post = await scheduler.run(
+                key, _style_key(text_source, style, verbosity, fresh),
+                lambda: get_openai().generate_post_in_style(text_source, style, verbosity=verbosity, force_fresh=fresh),
+            )
+        except Superseded:
+            return
+        except Exception as e:
+            # Кнопки возвращаем: черновик остаётся прежним, стиль можно выбрать ещё раз
+            await callback.message.edit_text(f"❌ Ошибка генерации: {e}", reply_markup=get_main_keyboard(key[1]))
+            return
+        drafts.pop(style, None)
+    sess.post_text = new_post
+    sess.style = style
+    SESSIONS.touch(key)
+    await callback.message.edit_text(new_post, reply_markup=get_main_keyboard(key[1]))
+
+
+@draft_action('edit')
+async def handle_edit(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
     await state.set_state(PostStates.waiting_for_edit)
-    user_id = callback.from_user.id
-    sess = SESSIONS.get(user_id)
-    current_text = (sess or {}).get('post_text', 'Текст отсутствует. Отправьте сообщение заново.')
+    # Какой черновик правим — в данных FSM: следующее сообщение админа относится к нему
+    await state.update_data(draft=key[1])
     # Показываем текущий текст отдельным сообщением, чтобы было удобно редактировать
     await callback.message.answer("Текущий текст поста:")
-    await callback.message.answer(current_text)
+    await callback.message.answer(sess.post_text)
     await callback.message.answer("✏️ Отправьте отредактированный текст поста:")
 
 
@@ -258,27 +812,123 @@ async def handle_edit(callback: types.CallbackQuery, state: FSMContext):
 async def handle_edit_text(message: types.Message, state: FSMContext):
     if not await guard_message(message):
         return
-    user_id = message.from_user.id
-    sess = SESSIONS.get(user_id)
-    if not sess:
-        await state.clear()
-        await message.answer("Сессия не найдена. Отправьте текст заново.")
+    found = await _state_draft(message, state)
+    if found is None:
         return
+    key, sess = found
     # При ручном редактировании сохраняем текст как есть, без повторной генерации
-    sess['post_text'] = message.text
+    sess.post_text = message.text
+    SESSIONS.touch(key)
     await state.clear()
     await message.answer("✅ Текст обновлён.")
-    await message.answer(sess['post_text'], reply_markup=get_main_keyboard())
+    await message.answer(sess.post_text, reply_markup=get_main_keyboard(key[1]))
 
 
-@dp.callback_query(lambda c: c.data == 'add_media')
-async def handle_add_media(callback: types.CallbackQuery, state: FSMContext):
+@draft_action('schedule')
+async def handle_schedule(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
+    if not sess.post_text:
+        await callback.answer("Пост не найден. Сгенерируйте заново.", show_alert=True)
+        return
+    await state.set_state(PostStates.waiting_for_schedule)
+    await state.update_data(draft=key[1])
+    await callback.message.answer(
+        "🕒 Когда опубликовать? Например: «завтра в 19:00», «в субботу в 10:00», «15 августа в 20:30»."
+    )
+    await callback.answer()
+
+
+@dp.message(PostStates.waiting_for_schedule)
+async def handle_schedule_time(message: types.Message, state: FSMContext):
+    if not await guard_message(message):
+        return
+    found = await _state_draft(message, state)
+    if found is None:
+        return
+    key, sess = found
+    due = parse_event_datetime(message.text or '', TZ.key)
+    if due is None:
+        await message.answer("Не понял время. Напишите, например: «завтра в 19:00».")
+        return
+    if due.timestamp() <= time.time():
+        await message.answer(f"Это время уже прошло ({format_dt_ru(due)}). Укажите время в будущем.")
+        return
+    if not CHANNEL_IDS:
+        await state.clear()
+        await message.answer("Не настроен TELEGRAM_CHANNEL_ID(S) в .env")
+        return
+    # Черновик переезжает в очередь целиком (текст + медиа) и больше не зависит от TTL сессий
+    job = publish_queue.add(key[0], due.timestamp(), sess.to_json())
+    _cancel_prefetch(key)
+    SESSIONS.pop(key, None)
+    await state.clear()
+    await message.answer(
+        f"🕒 Запланировано на {format_dt_ru(due)}. Все отложенные посты — /scheduled.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отменить публикацию", callback_data=JobCb(id=job.id).pack())],
+        ]),
+    )
+
+
+@dp.callback_query(JobCb.filter())
+async def handle_unschedule(callback: types.CallbackQuery, callback_data: JobCb):
     if not await guard_callback(callback):
         return
+    user_id = callback.from_user.id
+    job = publish_queue.get(callback_data.id)
+    if job is None or job.owner != user_id:
+        await callback.answer("Этого поста уже нет в очереди.", show_alert=True)
+        return
+    if publish_queue.cancel(job.id) is None:
+        await callback.answer("Пост уже публикуется.", show_alert=True)
+        return
+    sess = Session.from_json(job.payload)
+    await callback.answer("Публикация отменена")
+    # Пост возвращается в работу отдельным черновиком
+    draft = new_draft_id()
+    SESSIONS[(user_id, draft)] = sess
+    await callback.message.answer(f"↩️ Публикация отменена, черновик возвращён:\n\n{sess.post_text}"[:4096],
+                                  reply_markup=get_main_keyboard(draft))
+
+
+def _format_due(job: Job) -> str:
+    return format_dt_ru(datetime.fromtimestamp(job.due_at, TZ))
+
+
+async def _notify(user_id: int, text: str):
+    # Уведомление автору не должно ломать публикацию: ошибка только в лог
+    try:
+        await bot.send_message(user_id, text[:4096])
+    except Exception as e:
+        logger.warning("Failed to notify %s: %s", user_id, e)
+
+
+async def _fire_scheduled(job: Job):
+    sess = Session.from_json(job.payload)
+    _, failed = await _publish_session(job.owner, sess, ('job', job.id))
+    if failed:
+        # Исключение — очередь повторит позже; уже отправленное в каналы не продублируется
+        raise RuntimeError("; ".join(f"{chat_id}: {e}" for chat_id, e in failed.items()))
+    preview = sess.post_text[:100] + ('…' if len(sess.post_text) > 100 else '')
+    await _notify(job.owner, f"✅ Опубликован запланированный пост ({_format_due(job)}):\n{preview}")
+
+
+async def _drop_scheduled(job: Job, reason: str):
+    sess = Session.from_json(job.payload)
+    if reason == 'expired':
+        head = (f"⏰ Пост на {_format_due(job)} не опубликован: бот был недоступен дольше "
+                f"{SCHEDULE_MAX_LATE_HOURS:g} ч. Текст:")
+    else:
+        head = f"❌ Не удалось опубликовать запланированный пост ({_format_due(job)}): {reason}. Текст:"
+    await _notify(job.owner, f"{head}\n\n{sess.post_text}")
+
+
+@draft_action('add_media')
+async def handle_add_media(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
     await state.set_state(PostStates.waiting_for_media)
+    await state.update_data(draft=key[1])
     await callback.message.edit_text(
         "📎 Отправьте фото/видео/аудио (до 3 файлов). Можно отправить несколько сообщений. Нажмите «Готово», когда закончите.",
-        reply_markup=get_media_keyboard(),
+        reply_markup=get_media_keyboard(key[1]),
     )
 
 
@@ -286,149 +936,459 @@ async def handle_add_media(callback: types.CallbackQuery, state: FSMContext):
 async def handle_media_upload(message: types.Message, state: FSMContext):
     if not await guard_message(message):
         return
-    user_id = message.from_user.id
-    sess = SESSIONS.get(user_id)
-    if not sess:
-        await state.clear()
-        await message.answer("Сессия не найдена. Отправьте текст заново.")
+    item = MediaItem.from_message(message)
+    if item is None:
+        await message.answer("Отправьте фото/видео/аудио.")
+        return
+    # Файлы альбома и быстрые загрузки подряд собираются в одну пачку — отвечает только первый апдейт
+    batch = await MEDIA_COLLECTOR.collect(
+        (message.chat.id, message.from_user.id), (message.media_group_id or message.message_id, item),
+    )
+    if batch is None:
+        return
+    found = await _state_draft(message, state)
+    if found is None:
         return
+    key, sess = found
+
+    groups: dict = {}
+    for group_id, grouped in batch:
+        groups.setdefault(group_id, []).append(grouped)
+    added, problems = 0, []
+    for items in groups.values():
+        # Ограничения Telegram проверяем сразу, а не при публикации; альбом добавляется целиком или никак
+        problem = check_group(sess.media, items, MAX_IMAGES)
+        if problem:
+            problems.append(problem)
+            continue
+        sess.media.extend(items)
+        added += len(items)
+    if added:
+        SESSIONS.touch(key)
+    lines = [f"⚠️ {p}" for p in dict.fromkeys(problems)]
+    if added:
+        lines.append(f"✅ Добавлено: {len(sess.media)}/{MAX_IMAGES}. Можете отправить ещё или нажать «Готово».")
+    await message.answer("\n".join(lines), reply_markup=get_media_keyboard(key[1]) if added else None)
+
+
+@draft_action('media_done')
+async def handle_media_done(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
+    await state.clear()
+    note = f"Прикреплено медиа: {len(sess.media)}/{MAX_IMAGES}"
+    if not caption_fits(sess.post_text, sess.media):
+        note += f"\n⚠️ Текст длиннее подписи ({CAPTION_LIMIT} симв.) — уйдёт отдельным сообщением после медиа."
+    await callback.message.edit_text(f"{sess.post_text}\n\n{note}", reply_markup=get_main_keyboard(key[1]))
+
+
+async def _publish_session(user_id: int, sess: Session, owner: tuple) -> tuple[list, dict]:
+    """Публикует черновик во все каналы. owner — что публикуется (ключ черновика, задание очереди):
+    по нему повторное нажатие продолжает упавшую публикацию. Возвращает шаги плана и ошибки по упавшим каналам."""
+    # Публикация: одиночное медиа → send_*; несколько фото/видео → альбом; аудио/voice отдельно.
+    # Один и тот же план (с теми же file_id) уходит во все каналы параллельно
+    steps = build_plan(sess.post_text, list(sess.media))
+    key = publish_key(owner, steps)
+    # Повторное нажатие во время публикации присоединяется к ней — в архив пишет только первое
+    joined = key in _publishing
+    _publishing.add(key)
+    try:
+        results = await publisher.publish_many(CHANNEL_IDS, steps, key=key, concurrency=PUBLISH_CONCURRENCY)
+    finally:
+        if not joined:
+            _publishing.discard(key)
+    failed = {chat_id: r for chat_id, r in results.items() if isinstance(r, BaseException)}
+    for chat_id, r in results.items():
+        if not isinstance(r, BaseException):
+            logger.info(
+                "Published for %s to %s: %s", user_id, chat_id,
+                ", ".join(f"{rep.method} {rep.latency * 1000:.0f} ms" for rep in r),
+            )
+    sent = any(reports for reports in results.values())
+    if not failed and sent and not joined:
+        # В архив — когда пост вышел во все каналы: повтор после частичной ошибки не создаст второй записи
+        try:
+            archive.add(user_id, sess.post_text, sess.original_text, sess.style,
+                        [asdict(m) for m in sess.media], CHANNEL_IDS, edited_at=sess.updated_at)
+        except Exception:
+            logger.exception("Failed to archive post of %s", user_id)
+    return steps, failed
 
-    media = sess.get('media', [])
-    if message.photo:
-        if len(media) >= MAX_IMAGES:
-            await message.answer(f"⚠️ Достигнут лимит медиа: {MAX_IMAGES}")
-        else:
-            media.append(f"photo:{message.photo[-1].file_id}")
-    elif message.video:
-        if len(media) >= MAX_IMAGES:
-            await message.answer(f"⚠️ Достигнут лимит медиа: {MAX_IMAGES}")
-        else:
-            media.append(f"video:{message.video.file_id}")
-    elif message.audio:
-        if len(media) >= MAX_IMAGES:
-            await message.answer(f"⚠️ Достигнут лимит медиа: {MAX_IMAGES}")
-        else:
-            media.append(f"audio:{message.audio.file_id}")
-    elif message.voice:
-        if len(media) >= MAX_IMAGES:
-            await message.answer(f"⚠️ Достигнут лимит медиа: {MAX_IMAGES}")
+
+@draft_action('publish')
+async def handle_publish(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
+    if not sess.post_text:
+        await callback.answer("Пост не найден. Сгенерируйте заново.", show_alert=True)
+        return
+    if not CHANNEL_IDS:
+        await callback.answer("Не настроен TELEGRAM_CHANNEL_ID(S) в .env", show_alert=True)
+        return
+    # «Всё равно опубликовать» идёт тем же путём: ключ идемпотентности привязан к этому черновику,
+    # поэтому с уже вышедшим похожим постом он не совпадает и пост действительно отправляется
+    if arg != 'force':
+        duplicate = archive.near_duplicate(sess.post_text)
+        if duplicate is not None:
+            when = format_dt_ru(datetime.fromtimestamp(duplicate.published_at, TZ))
+            preview = duplicate.post_text[:300] + ('…' if len(duplicate.post_text) > 300 else '')
+            await callback.answer()
+            await callback.message.answer(
+                f"⚠️ Похожий пост уже выходил {when} (совпадение {duplicate.score:.0%}):\n\n{preview}",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [_draft_button("📤 Всё равно опубликовать", 'publish', key[1], 'force')],
+                    [_draft_button("📝 К черновику", 'show', key[1])],
+                ]),
+            )
+            return
+
+    steps, failed = await _publish_session(key[0], sess, key)
+    if not failed:
+        done = "✅ Опубликовано!" if len(CHANNEL_IDS) == 1 else f"✅ Опубликовано во все каналы ({len(CHANNEL_IDS)})"
+        await callback.message.edit_text(done, reply_markup=None)
+        # Удаляем черновик и его недоделанные стили; остальные черновики админа не трогаем
+        _cancel_prefetch(key)
+        SESSIONS.pop(key, None)
+        return
+
+    if len(CHANNEL_IDS) == 1:
+        e = next(iter(failed.values()))
+        if isinstance(e, PublishError):
+            # Уже отправленное запомнено: повторное «Опубликовать» продолжит с упавшего шага, без дублей
+            await callback.answer(
+                f"Ошибка публикации: {e} (отправлено {len(e.reports)} из {len(steps)}, нажмите ещё раз, чтобы продолжить)",
+                show_alert=True,
+            )
         else:
-            media.append(f"voice:{message.voice.file_id}")
-    else:
-        await message.answer("Отправьте фото/видео/аудио.")
+            await callback.answer(f"Ошибка публикации: {e}", show_alert=True)
         return
 
-    sess['media'] = media[:MAX_IMAGES]
-    await message.answer(
-        f"✅ Добавлено: {len(sess['media'])}/{MAX_IMAGES}. Можете отправить ещё или нажать «Готово».",
-        reply_markup=get_media_keyboard(),
-    )
+    # Частичный успех: сводка по каналам; повторное нажатие дошлёт только в упавшие
+    lines = [f"⚠️ Опубликовано: {len(CHANNEL_IDS) - len(failed)}/{len(CHANNEL_IDS)}"]
+    for chat_id in CHANNEL_IDS:
+        lines.append(f"❌ {chat_id}: {failed[chat_id]}" if chat_id in failed else f"✅ {chat_id}")
+    lines.append("Нажмите «Опубликовать» ещё раз, чтобы повторить для упавших каналов.")
+    await callback.message.answer("\n".join(lines))
+    await callback.answer()
 
 
-@dp.callback_query(lambda c: c.data == 'media_done')
-async def handle_media_done(callback: types.CallbackQuery, state: FSMContext):
-    if not await guard_callback(callback):
+@draft_action('back')
+async def handle_back(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
+    await callback.message.edit_text(sess.post_text, reply_markup=get_main_keyboard(key[1]))
+
+
+@draft_action('cancel')
+async def handle_cancel(callback: types.CallbackQuery, state: FSMContext, key: tuple, sess: Session, arg: str | None):
+    _cancel_prefetch(key)
+    SESSIONS.pop(key, None)
+    # Шаг FSM (правка, медиа, время) сбрасываем, только если он относится к этому черновику
+    if (await state.get_data()).get('draft') == key[1]:
+        await state.clear()
+    await callback.message.edit_text("❌ Черновик отменён. Остальные черновики — /drafts")
+
+
+# ---- Пакетный режим: черновики пакета лежат в SESSIONS под ключами (user_id, 'batch', n) ----
+
+def _batch_key(user_id: int, n: int) -> tuple:
+    return (user_id, 'batch', n)
+
+
+def _batch_keys(user_id: int) -> list[tuple]:
+    return sorted(k for k in SESSIONS if isinstance(k, tuple) and k[:2] == (user_id, 'batch') and k in SESSIONS)
+
+
+def _drop_batch(user_id: int):
+    for key in _batch_keys(user_id):
+        SESSIONS.pop(key, None)
+
+
+def _batch_page(user_id: int, page: int) -> tuple[str, InlineKeyboardMarkup] | None:
+    keys = _batch_keys(user_id)
+    if not keys:
+        return None
+    page = max(0, min(page, len(keys) - 1))
+    sess = SESSIONS[keys[page]]
+    n = keys[page][2]
+    body = sess.post_text or f"❌ Не удалось сгенерировать. Исходный текст:\n{sess.original_text}"
+    text = f"📚 Пост {page + 1}/{len(keys)}\n\n{body}"[:4096]
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            _batch_button("◀️", 'page', max(page - 1, 0)),
+            _batch_button(f"{page + 1}/{len(keys)}", 'noop'),
+            _batch_button("▶️", 'page', min(page + 1, len(keys) - 1)),
+        ],
+        [
+            _batch_button("🔁 Заново", 'regen', n),
+            _batch_button("📝 Открыть", 'open', n),
+            _batch_button("🗑 Убрать", 'drop', n),
+        ],
+        [_batch_button(f"📤 Опубликовать все ({len(keys)})", 'publish')],
+        [_batch_button(f"🕒 По одному каждые {BATCH_INTERVAL_MINUTES:g} мин", 'stagger')],
+        [_batch_button("❌ Отменить пакет", 'cancel')],
+    ])
+    return text, keyboard
+
+
+async def _show_batch_page(msg: types.Message, user_id: int, page: int):
+    rendered = _batch_page(user_id, page)
+    if rendered is None:
+        await _safe_edit(msg, "📚 Пакет пуст.")
         return
-    await state.clear()
-    user_id = callback.from_user.id
-    sess = SESSIONS.get(user_id)
-    text = (sess or {}).get('post_text', 'Текст отсутствует. Отправьте сообщение заново.')
-    await callback.message.edit_text(
-        f"{text}\n\nПрикреплено медиа: {len((sess or {}).get('media', []))}/{MAX_IMAGES}",
-        reply_markup=get_main_keyboard(),
-    )
+    await _safe_edit(msg, rendered[0], reply_markup=rendered[1])
 
 
-@dp.callback_query(lambda c: c.data == 'publish')
-async def handle_publish(callback: types.CallbackQuery):
-    if not await guard_callback(callback):
+@dp.message(BatchStates.waiting_for_items)
+async def handle_batch_items(message: types.Message, state: FSMContext):
+    if not await guard_message(message):
+        return
+    if message.document:
+        doc = message.document
+        name = doc.file_name or ''
+        if not name.lower().endswith(('.txt', '.csv')):
+            await message.answer("Нужен файл .txt или .csv.")
+            return
+        if doc.file_size and doc.file_size > BATCH_MAX_FILE_KB * 1024:
+            await message.answer(f"⚠️ Файл слишком большой. Лимит — {BATCH_MAX_FILE_KB} КБ.")
+            return
+        buffer = await bot.download(doc.file_id)
+        items = parse_upload(name, buffer.getvalue())
+    elif message.text:
+        items = split_text(message.text)
+    else:
+        await message.answer("Пришлите текст или файл .txt/.csv.")
+        return
+    await _start_batch(message, state, items)
+
+
+async def _start_batch(message: types.Message, state: FSMContext, items: list[str]):
+    """Генерирует черновики для всех пунктов параллельно (не больше BATCH_CONCURRENCY разом)
+    и показывает их постраничным списком."""
+    await state.set_state(None)
+    user_id = message.from_user.id
+    if not items:
+        await message.answer("Не нашёл ни одного пункта. Разделите их строкой «---» или пустой строкой.")
         return
+    if len(items) > BATCH_MAX_ITEMS:
+        await message.answer(f"⚠️ Пунктов {len(items)}, беру первые {BATCH_MAX_ITEMS}.")
+        items = items[:BATCH_MAX_ITEMS]
+    _drop_batch(user_id)
+    status = await message.answer(f"🤖 Генерирую посты: 0/{len(items)}…")
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+    done = 0
+    next_edit_at = 0.0
+
+    async def generate(n: int, text: str):
+        nonlocal done, next_edit_at
+        verbosity = _detect_verbosity(text)
+        async with limit:
+            try:
+                # owner=None: пункты пакета не вытесняют друг друга; одинаковые тексты склеиваются
+                post = await scheduler.run(
+                    None, make_key(kind='post', text=text, verbosity=verbosity),
+                    lambda: get_openai().generate_post_from_text(text, verbosity=verbosity),
+                )
+            except Exception as e:
+                logger.warning("Batch item %s failed for user %s: %s", n, user_id, e)
+                post = ''
+        SESSIONS[_batch_key(user_id, n)] = Session(original_text=text, post_text=post)
+        done += 1
+        now = loop.time()
+        if done < len(items) and now >= next_edit_at:
+            next_edit_at = now + STREAM_EDIT_INTERVAL
+            try:
+                await _safe_edit(status, f"🤖 Генерирую посты: {done}/{len(items)}…")
+            except TelegramRetryAfter as e:
+                next_edit_at = now + e.retry_after
+
+    started = loop.time()
+    await asyncio.gather(*(generate(n, text) for n, text in enumerate(items)))
+    logger.info("Batch of %d items for user %s generated in %.1fs", len(items), user_id, loop.time() - started)
+    await _show_batch_page(status, user_id, 0)
+
+
+@batch_action('noop')
+async def handle_batch_noop(callback: types.CallbackQuery, callback_data: BatchCb):
+    await callback.answer()
+
+
+@batch_action('page')
+async def handle_batch_page(callback: types.CallbackQuery, callback_data: BatchCb):
+    await _show_batch_page(callback.message, callback.from_user.id, callback_data.n)
+    await callback.answer()
+
+
+@batch_action('regen', 'open', 'drop')
+async def handle_batch_item(callback: types.CallbackQuery, callback_data: BatchCb):
     user_id = callback.from_user.id
-    sess = SESSIONS.get(user_id)
-    if not sess or not sess.get('post_text'):
-        await callback.answer("Пост не найден. Сгенерируйте заново.", show_alert=True)
+    action = callback_data.action
+    key = _batch_key(user_id, callback_data.n)
+    keys = _batch_keys(user_id)
+    if key not in keys:
+        await callback.answer("Этого поста уже нет в пакете.", show_alert=True)
         return
-    if not CHANNEL_ID_RAW:
-        await callback.answer("Не настроен TELEGRAM_CHANNEL_ID в .env", show_alert=True)
+    page = keys.index(key)
+    sess = SESSIONS[key]
+    if action == 'open':
+        # Пост уходит из пакета в обычный черновик: стили, правка, медиа, публикация — как обычно
+        draft = new_draft_id()
+        SESSIONS[(user_id, draft)] = SESSIONS.pop(key)
+        await callback.message.answer(sess.post_text or sess.original_text, reply_markup=get_main_keyboard(draft))
+        await _show_batch_page(callback.message, user_id, page)
+    elif action == 'drop':
+        SESSIONS.pop(key, None)
+        await _show_batch_page(callback.message, user_id, page)
+    else:
+        await callback.answer("🤖 Генерирую заново…")
+        text = sess.original_text
+        verbosity = _detect_verbosity(text)
+        try:
+            post = await scheduler.run(
+                key, make_key(kind='post', text=text, verbosity=verbosity, fresh=True),
+                lambda: get_openai().generate_post_from_text(text, verbosity=verbosity, force_fresh=True),
+            )
+        except Superseded:
+            return
+        except Exception as e:
+            await callback.message.answer(f"❌ Ошибка генерации: {e}")
+            return
+        if key in SESSIONS and post:
+            sess.post_text = post
+            SESSIONS.touch(key)
+        await _show_batch_page(callback.message, user_id, page)
         return
+    await callback.answer()
 
-    post_text = sess['post_text']
-    media = list(sess.get('media', []))
 
-    # Определяем chat_id
-    chat_id: int | str
-    try:
-        chat_id = int(CHANNEL_ID_RAW)
-    except Exception:
-        chat_id = CHANNEL_ID_RAW  # @username
-
-    try:
-        # Публикация: одиночное медиа → send_*; несколько фото/видео → альбом; аудио/voice отдельно
-        if not media:
-            await bot.send_message(chat_id=chat_id, text=post_text)
+async def _publish_batch(user_id: int, keys: list[tuple]) -> tuple[int, int]:
+    """Публикует посты пакета по порядку. Опубликованные убираются из пакета, упавшие остаются.
+    Возвращает (опубликовано, ошибок)."""
+    published = errors = 0
+    for key in keys:
+        sess = SESSIONS.get(key)
+        if not sess or not sess.post_text:
+            continue
+        try:
+            _, failed = await _publish_session(user_id, sess, key)
+        except Exception:
+            logger.exception("Batch publish failed for %s", key)
+            failed = True
+        if failed:
+            errors += 1
         else:
-            photos_videos = [m for m in media if m.startswith(('photo:', 'video:'))]
-            audios = [m for m in media if m.startswith('audio:')]
-            voices = [m for m in media if m.startswith('voice:')]
-
-            if len(photos_videos) <= 1 and not audios and not voices:
-                m = photos_videos[0]
-                if m.startswith('photo:'):
-                    await bot.send_photo(chat_id=chat_id, photo=m.split(':',1)[1], caption=post_text)
-                elif m.startswith('video:'):
-                    await bot.send_video(chat_id=chat_id, video=m.split(':',1)[1], caption=post_text)
-            else:
-                media_group: list[types.InputMedia] = []
-                for i, m in enumerate(photos_videos):
-                    if m.startswith('photo:'):
-                        mid = m.split(':',1)[1]
-                        media_group.append(types.InputMediaPhoto(media=mid, caption=post_text if i==0 else None))
-                    elif m.startswith('video:'):
-                        mid = m.split(':',1)[1]
-                        media_group.append(types.InputMediaVideo(media=mid, caption=post_text if i==0 else None))
-                if media_group:
-                    await bot.send_media_group(chat_id=chat_id, media=media_group)
-                # Аудио/войс отправляем отдельно (без альбома)
-                for a in audios:
-                    await bot.send_audio(chat_id=chat_id, audio=a.split(':',1)[1])
-                for v in voices:
-                    await bot.send_voice(chat_id=chat_id, voice=v.split(':',1)[1])
-
-        await callback.message.edit_text("✅ Опубликовано!", reply_markup=None)
-        # Очищаем сессию
-        SESSIONS.pop(user_id, None)
-    except Exception as e:
-        await callback.answer(f"Ошибка публикации: {e}", show_alert=True)
+            published += 1
+            SESSIONS.pop(key, None)
+    return published, errors
 
 
-@dp.callback_query(lambda c: c.data == 'back_main')
-async def handle_back(callback: types.CallbackQuery):
-    if not await guard_callback(callback):
-        return
+@batch_action('publish', 'stagger')
+async def handle_batch_publish(callback: types.CallbackQuery, callback_data: BatchCb):
     user_id = callback.from_user.id
-    sess = SESSIONS.get(user_id)
-    text = (sess or {}).get('post_text', 'Текст отсутствует. Отправьте сообщение заново.')
-    await callback.message.edit_text(text, reply_markup=get_main_keyboard())
+    if not CHANNEL_IDS:
+        await callback.answer("Не настроен TELEGRAM_CHANNEL_ID(S) в .env", show_alert=True)
+        return
+    keys = [k for k in _batch_keys(user_id) if SESSIONS[k].post_text]
+    if not keys:
+        await callback.answer("В пакете нет готовых постов.", show_alert=True)
+        return
 
+    if callback_data.action == 'publish':
+        await callback.answer("📤 Публикую…")
+        published, errors = await _publish_batch(user_id, keys)
+        summary = f"✅ Опубликовано: {published}/{len(keys)}"
+        if errors:
+            summary += f"\n❌ С ошибкой: {errors} — остались в пакете, можно повторить"
+        await callback.message.answer(summary)
+        await _show_batch_page(callback.message, user_id, 0)
+        return
 
-@dp.callback_query(lambda c: c.data == 'cancel')
-async def handle_cancel(callback: types.CallbackQuery, state: FSMContext):
-    if not await guard_callback(callback):
+    # По одному с интервалом — через очередь отложенных публикаций: первый сразу, остальные переживут рестарт
+    interval = BATCH_INTERVAL_MINUTES * 60
+    now = time.time()
+    for i, key in enumerate(keys):
+        publish_queue.add(user_id, now + i * interval, SESSIONS.pop(key).to_json())
+    last_at = datetime.fromtimestamp(now + interval * (len(keys) - 1), TZ)
+    await callback.answer()
+    await _safe_edit(
+        callback.message,
+        f"🕒 {len(keys)} постов в очереди: первый — сейчас, дальше каждые {BATCH_INTERVAL_MINUTES:g} мин, "
+        f"последний — около {format_dt_ru(last_at)}. Список и отмена — /scheduled.",
+    )
+
+
+@batch_action('cancel')
+async def handle_batch_cancel(callback: types.CallbackQuery, callback_data: BatchCb):
+    _drop_batch(callback.from_user.id)
+    await _safe_edit(callback.message, "❌ Пакет отменён.")
+
+
+@dp.callback_query()
+async def handle_stale_button(callback: types.CallbackQuery):
+    # Кнопки под сообщениями, отправленными до черновиков с id, ни к чему не привязаны
+    await callback.answer("Кнопка устарела. Черновики — /drafts", show_alert=True)
+
+
+async def _warm_openai():
+    # Импорт openai/httpx блокирует — уводим его в поток, чтобы не тормозить обработку апдейтов
+    await asyncio.to_thread(importlib.import_module, 'openai_client')
+    await get_openai().warm_up()
+
+
+async def on_startup():
+    """Бот уже принимает апдейты — печатаем разбивку старта и прогреваем тяжёлое в фоне."""
+    global _warm_up_task
+    startup_timer.mark('connect')
+    startup_timer.report('🏁 Бот запущен')
+    if not WARM_UP:
         return
-    SESSIONS.pop(callback.from_user.id, None)
-    await state.clear()
-    await callback.message.edit_text("❌ Операция отменена. Отправьте текст заново.")
+    steps = [
+        ('openai', _warm_openai),
+        ('tokenizer', lambda: asyncio.to_thread(get_openai().prompts.warm_up)),
+        ('dateparser', lambda: asyncio.to_thread(time_parser.warm_up)),
+    ]
+    if BOT_MODE == 'webhook':
+        # В polling getMe делает сам aiogram; в режиме вебхука — открываем сессию Bot API заранее
+        steps.append(('telegram', bot.me))
+    _warm_up_task = asyncio.create_task(warm_up(startup_timer, steps))
 
 
-async def main():
-    def signal_handler(signum, frame):
-        logger.info("🛑 Завершение...")
-        sys.exit(0)
+dp.startup.register(on_startup)
 
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
 
-    await dp.start_polling(bot, skip_updates=True)
+async def main():
+    stop = stop_event()
+    state_db.start()
+    publish_queue.start(_fire_scheduled, _drop_scheduled)
+    metrics_runner = None
+    try:
+        if METRICS_PORT:
+            metrics_runner = await start_metrics_server(REGISTRY, METRICS_HOST, METRICS_PORT, METRICS_PATH)
+        if BOT_MODE == 'webhook':
+            app = web.Application()
+            if METRICS_ON_WEBHOOK:
+                add_metrics_route(app, REGISTRY, METRICS_PATH)
+            await run_webhook(
+                dp, bot, inflight, stop,
+                host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, url=WEBHOOK_URL,
+                secret=WEBHOOK_SECRET, drop_pending=DROP_PENDING_UPDATES, drain_timeout=SHUTDOWN_TIMEOUT,
+                app=app,
+            )
+        else:
+            await run_polling(dp, bot, inflight, stop, drop_pending=DROP_PENDING_UPDATES,
+                              drain_timeout=SHUTDOWN_TIMEOUT)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await publish_queue.close(timeout=SHUTDOWN_TIMEOUT)
+        archive.close()
+        # Дописываем на диск всё, что накопилось с последнего сброса
+        await state_db.close()
+        if _warm_up_task and not _warm_up_task.done():
+            _warm_up_task.cancel()
+        logger.info("Generation scheduler: %s", scheduler.stats())
+        if _openai_client is not None:
+            logger.info("OpenAI resilience: %s", _openai_client.resilience.stats())
+            if _openai_client.cache:
+                logger.info("Generation cache: %s", _openai_client.cache.stats())
+            await _openai_client.aclose()
+        await bot.session.close()
+        logger.info("🛑 Бот остановлен")
 
 
 if __name__ == "__main__":
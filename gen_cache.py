@@ -0,0 +1,95 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def make_key(**parts) -> str:
+    """Ключ кэша — sha256 от всех параметров, влияющих на ответ модели."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """LRU-кэш сгенерированных текстов с TTL. Если задан path — дублирует записи в SQLite,
+    чтобы попадания переживали рестарт бота."""
+
+    # Как часто (в записях) чистить просроченное на диске
+    _PURGE_EVERY = 200
+
+    def __init__(self, max_items: int = 256, ttl: float = 86400, path: Optional[str] = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # key → (expires_at, text); порядок = давность использования
+        self._items: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._writes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._purge_disk()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        item = self._items.get(key)
+        if item is not None:
+            if item[0] > now:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            del self._items[key]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT text, expires_at FROM generations WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    def set(self, key: str, text: str) -> None:
+        expires_at = time.time() + self.ttl
+        self._remember(key, text, expires_at)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO generations (key, text, expires_at) VALUES (?, ?, ?)",
+                (key, text, expires_at),
+            )
+            self._writes += 1
+            if self._writes % self._PURGE_EVERY == 0:
+                self._purge_disk()
+            self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._items),
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key: str, text: str, expires_at: float) -> None:
+        self._items[key] = (expires_at, text)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def _purge_disk(self) -> None:
+        self._db.execute("DELETE FROM generations WHERE expires_at <= ?", (time.time(),))
+        self._db.commit()
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Фабрика запроса к OpenAI: корутина с результатом или асинхронный генератор кусочков текста
+Factory = Callable[[], Union[Awaitable[Any], AsyncIterator[str]]]
+
+
+class Superseded(Exception):
+    """Запрос вытеснен более новым запросом того же владельца — его результат уже не нужен."""
+
+
+class _Shared:
+    """Один вызов OpenAI, результат (или поток кусочков) которого получают все одинаковые запросы."""
+
+    __slots__ = ("task", "chunks", "changed", "refs")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.chunks: List[str] = []
+        self.changed: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.refs = 0
+
+    def push(self, delta: str) -> None:
+        self.chunks.append(delta)
+        self.notify()
+
+    def notify(self) -> None:
+        if not self.changed.done():
+            self.changed.set_result(None)
+        self.changed = asyncio.get_running_loop().create_future()
+
+
+class GenerationScheduler:
+    """Очередь запросов к OpenAI:
+
+    - не больше max_concurrent вызовов одновременно на весь бот;
+    - у одного владельца (админа) в работе один запрос: новый вытесняет старый, старый получает
+      Superseded и не трогает черновик (побеждает последний);
+    - одинаковые одновременные запросы (тот же key) склеиваются в один вызов; вызов отменяется,
+      только когда его больше никто не ждёт."""
+
+    def __init__(self, max_concurrent: int = 8):
+        self._limit = asyncio.Semaphore(max_concurrent)
+        self._shared: Dict[str, _Shared] = {}
+        # владелец → «флажок вытеснения» текущего запроса
+        self._owners: Dict[Hashable, asyncio.Future] = {}
+        self.queued = 0  # вызовы, ждущие свободного слота
+        self.coalesced = 0
+        self.superseded = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": len(self._shared), "queued": self.queued,
+                "coalesced": self.coalesced, "superseded": self.superseded}
+
+    async def run(self, owner: Optional[Hashable], key: str, factory: Factory) -> Any:
+        """Выполняет запрос и возвращает результат. owner=None — без вытеснения (фоновые задачи)."""
+        mine = self._claim(owner)
+        shared = self._join(key, factory)
+        try:
+            waiters = {shared.task, mine} if mine else {shared.task}
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            # Проверяем вытеснение первым: даже готовый результат старого запроса не должен перезаписать новый
+            if mine and mine.done():
+                raise Superseded()
+            return shared.task.result()
+        finally:
+            self._leave(key, shared)
+            self._release(owner, mine)
+
+    async def stream(self, owner: Optional[Hashable], key: str, factory: Factory) -> AsyncIterator[str]:
+        """То же для потоковой генерации: factory возвращает асинхронный генератор, каждый
+        подписчик получает все кусочки с начала, даже если подключился к уже идущему вызову.
+        Если под тем же ключом уже идёт обычный вызов (run), его результат приходит одним куском."""
+        mine = self._claim(owner)
+        shared = self._join(key, factory)
+        try:
+            i = 0
+            while True:
+                changed = shared.changed
+                while i < len(shared.chunks):
+                    yield shared.chunks[i]
+                    i += 1
+                    if mine and mine.done():
+                        raise Superseded()
+                if shared.task.done():
+                    result = shared.task.result()  # пробрасываем ошибку вызова
+                    if not shared.chunks and result:
+                        # Подключились к обычному (не потоковому) вызову — кусочков нет, отдаём результат целиком
+                        yield result
+                    return
+                await asyncio.wait({changed, mine} if mine else {changed}, return_when=asyncio.FIRST_COMPLETED)
+                if mine and mine.done():
+                    raise Superseded()
+        finally:
+            self._leave(key, shared)
+            self._release(owner, mine)
+
+    def _claim(self, owner: Optional[Hashable]) -> Optional[asyncio.Future]:
+        if owner is None:
+            return None
+        prev = self._owners.get(owner)
+        if prev is not None and not prev.done():
+            prev.set_result(None)
+            self.superseded += 1
+        mine = asyncio.get_running_loop().create_future()
+        self._owners[owner] = mine
+        return mine
+
+    def _release(self, owner: Optional[Hashable], mine: Optional[asyncio.Future]) -> None:
+        if mine is None:
+            return
+        if self._owners.get(owner) is mine:
+            del self._owners[owner]
+        if not mine.done():
+            mine.cancel()
+
+    def _join(self, key: str, factory: Factory) -> _Shared:
+        shared = self._shared.get(key)
+        if shared is None:
+            shared = self._shared[key] = _Shared()
+            shared.task = asyncio.create_task(self._call(key, shared, factory))
+            shared.task.add_done_callback(self._on_done)
+        else:
+            self.coalesced += 1
+        shared.refs += 1
+        return shared
+
+    def _leave(self, key: str, shared: _Shared) -> None:
+        shared.refs -= 1
+        if shared.refs == 0 and not shared.task.done():
+            # Результат больше никому не нужен — освобождаем слот и соединение
+            if self._shared.get(key) is shared:
+                del self._shared[key]
+            shared.task.cancel()
+
+    async def _call(self, key: str, shared: _Shared, factory: Factory) -> Any:
+        self.queued += 1
+        try:
+            await self._limit.acquire()
+        except BaseException:
+            self._forget(key, shared)
+            raise
+        finally:
+            self.queued -= 1
+        try:
+            result = factory()
+            if not hasattr(result, "__aiter__"):
+                return await result
+            async with aclosing(result) as chunks:
+                async for delta in chunks:
+                    shared.push(delta)
+            return "".join(shared.chunks)
+        finally:
+            self._limit.release()
+            self._forget(key, shared)
+
+    def _forget(self, key: str, shared: _Shared) -> None:
+        if self._shared.get(key) is shared:
+            del self._shared[key]
+        shared.notify()
+
+    @staticmethod
+    def _on_done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            # Ошибку получают ждущие; здесь только помечаем её прочитанной
+            logger.debug("Generation failed: %s", task.exception())
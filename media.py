@@ -0,0 +1,121 @@
+import asyncio
+from dataclasses import dataclass, fields
+from typing import Dict, Generic, Hashable, List, Optional, TypeVar, Union
+
+from aiogram import types
+
+# Что Telegram собирает в альбом: фото и видео вместе, до 10 штук; аудио/voice уходят отдельно
+ALBUM_KINDS = ('photo', 'video')
+ALBUM_MAX = 10
+# Подпись к медиа короче обычного сообщения (4096)
+CAPTION_LIMIT = 1024
+
+T = TypeVar("T")
+
+
+@dataclass(slots=True)
+class MediaItem:
+    """Вложение черновика: всё, что нужно для отправки, снимается один раз при загрузке."""
+    kind: str  # photo | video | audio | voice
+    file_id: str
+    file_unique_id: str  # одинаков у повторно присланного файла — по нему убираем дубли
+    size: Optional[int] = None
+    duration: Optional[int] = None
+
+    @property
+    def in_album(self) -> bool:
+        return self.kind in ALBUM_KINDS
+
+    def input_media(self, caption: Optional[str] = None) -> types.InputMedia:
+        input_cls = types.InputMediaPhoto if self.kind == 'photo' else types.InputMediaVideo
+        return input_cls(media=self.file_id, caption=caption)
+
+    @classmethod
+    def from_message(cls, message: types.Message) -> Optional["MediaItem"]:
+        if message.photo:
+            photo = message.photo[-1]  # самый большой размер
+            return cls('photo', photo.file_id, photo.file_unique_id, photo.file_size)
+        for kind in ('video', 'audio', 'voice'):
+            media = getattr(message, kind)
+            if media:
+                return cls(kind, media.file_id, media.file_unique_id, media.file_size, media.duration)
+        return None
+
+    @classmethod
+    def from_json(cls, raw: Union[dict, str]) -> "MediaItem":
+        if isinstance(raw, str):
+            # Черновики, сохранённые до появления MediaItem: строки вида "photo:<file_id>"
+            kind, file_id = raw.split(':', 1)
+            return cls(kind, file_id, file_id)
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in raw.items() if k in known})
+
+
+def check_attach(media: List[MediaItem], item: MediaItem, limit: int) -> Optional[str]:
+    """Почему вложение нельзя добавить к уже прикреплённым (None — можно). Проверяется при загрузке,
+    чтобы публикация не упала на середине из-за ограничений Telegram."""
+    if any(m.file_unique_id == item.file_unique_id for m in media):
+        return "Этот файл уже прикреплён."
+    if len(media) >= limit:
+        return f"Достигнут лимит медиа: {limit}"
+    if item.in_album and sum(m.in_album for m in media) >= ALBUM_MAX:
+        return f"В альбоме Telegram не больше {ALBUM_MAX} фото/видео."
+    return None
+
+
+def caption_fits(text: str, media: List[MediaItem]) -> bool:
+    """Поместится ли текст подписью к фото/видео; если нет — он уйдёт отдельным сообщением."""
+    return len(text or '') <= CAPTION_LIMIT or not any(m.in_album for m in media)
+
+
+def check_group(media: List[MediaItem], items: List[MediaItem], limit: int) -> Optional[str]:
+    """check_attach для альбома целиком: добавляются либо все его файлы, либо ни один."""
+    if len(items) > 1 and len(media) + len(items) > limit:
+        return (f"Альбом из {len(items)} файлов не помещается: свободно {max(0, limit - len(media))} "
+                f"из {limit}. Отправьте меньше файлов.")
+    merged = list(media)
+    for item in items:
+        problem = check_attach(merged, item, limit)
+        if problem:
+            return problem
+        merged.append(item)
+    return None
+
+
+@dataclass(slots=True)
+class _Pending:
+    items: list
+    started: float
+    last: float
+
+
+class MediaCollector(Generic[T]):
+    """Склейка вложений, пришедших подряд. Альбом Telegram приходит отдельными апдейтами
+    с одним media_group_id; быстрые одиночные загрузки выглядят так же. Первый апдейт по ключу
+    ждёт, пока новые не перестанут приходить debounce сек (но не дольше max_wait), и получает
+    всю пачку; остальные только докладывают свой элемент и получают None — отвечает один."""
+
+    def __init__(self, debounce: float = 0.6, max_wait: float = 3.0):
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self._pending: Dict[Hashable, _Pending] = {}
+
+    async def collect(self, key: Hashable, item: T) -> Optional[List[T]]:
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.items.append(item)
+            pending.last = now
+            return None
+        pending = self._pending[key] = _Pending([item], started=now, last=now)
+        try:
+            while True:
+                wait = min(pending.last + self.debounce, pending.started + self.max_wait) - loop.time()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        finally:
+            # Следующий апдейт после этой точки начнёт новую пачку
+            del self._pending[key]
+        return pending.items
@@ -0,0 +1,189 @@
+import abc
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Границы бакетов (сек): от быстрых ответов Bot API до длинных генераций и распознавания
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abc.abstractmethod
+    def _samples(self) -> List[str]:
+        ...
+
+    @abc.abstractmethod
+    def summary(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}" for k, v in self._values.items()]
+
+    def summary(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, k)}: {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Текущее значение, которое снимается в момент чтения (длина очереди, число апдейтов в работе)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], float]):
+        super().__init__(name, doc)
+        self.fn = fn
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.fn())}"]
+
+    def summary(self) -> List[str]:
+        return [f"{self.name}: {_format_value(self.fn())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки → счётчики по бакетам без накопления (последний — +Inf) и сумма наблюдений
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, q: float, **labels: str) -> Optional[float]:
+        """Оценка квантиля по бакетам (линейная интерполяция, как histogram_quantile в Prometheus)."""
+        counts = self._counts.get(self._key(labels))
+        return self._quantile(counts, q) if counts else None
+
+    def _quantile(self, counts: List[int], q: float) -> Optional[float]:
+        count = sum(counts)
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for upper, n in zip(self.buckets, counts):
+            if seen + n >= rank and n:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return self.buckets[-1]  # попали в +Inf — известна только нижняя граница
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for upper, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if upper == float("inf") else f'le="{_format_value(upper)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+    def summary(self) -> List[str]:
+        lines = []
+        for key, counts in sorted(self._counts.items()):
+            count = sum(counts)
+            p50, p95 = self._quantile(counts, 0.5), self._quantile(counts, 0.95)
+            lines.append(
+                f"{self.name}{_format_labels(self.labels, key)}: n={count} "
+                f"avg={self._sums[key] / count:.2f} p50≈{p50:.2f} p95≈{p95:.2f}"
+            )
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, doc, labels))
+
+    def gauge(self, name: str, doc: str, fn: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, doc, fn))
+
+    def histogram(self, name: str, doc: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, doc, labels, buckets))
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Короткая сводка для админа в чате: количество, среднее и p50/p95 по каждой серии."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.summary())
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
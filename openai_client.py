@@ -1,8 +1,49 @@
-from typing import List, Optional
+from typing import AsyncIterator, BinaryIO, Callable, List, Optional, Tuple, Union
+import asyncio
+import io
+import logging
 import os
-from openai import OpenAI
-import tempfile
-from pathlib import Path
+import time
+from dataclasses import dataclass
+import httpx
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, RateLimitError
+from audio_chunks import cut_segment, ffmpeg_available, segment_starts, stitch
+from gen_cache import GenerationCache, make_key
+from prompts import PromptBuilder
+from resilience import Resilience
+
+logger = logging.getLogger(__name__)
+
+# Аудио для распознавания: байты, файловый объект или (имя файла, файловый объект)
+AudioInput = Union[bytes, BinaryIO, Tuple[str, BinaryIO]]
+
+
+def _retryable(error: BaseException) -> bool:
+    # Временные сбои: сеть/таймаут, 429, 5xx. Ошибки запроса (400, 401…) повторять бессмысленно
+    return isinstance(error, (APIConnectionError, RateLimitError, InternalServerError, TimeoutError))
+
+
+async def _first_delta(chunks: AsyncIterator) -> str:
+    async for chunk in chunks:
+        if chunk.choices and chunk.choices[0].delta.content:
+            return chunk.choices[0].delta.content
+    return ""
+
+
+async def _close_stream(opened: tuple) -> None:
+    await opened[0].close()
+
+
+@dataclass(slots=True)
+class CallStats:
+    """Итог одного запроса к API для наблюдателя on_call (метрики)."""
+    kind: str  # generate | stream | style | transcribe
+    model: str
+    duration: float  # сек
+    prompt_tokens: Optional[int] = None  # у потоковой генерации usage не приходит — считаем локально
+    completion_tokens: Optional[int] = None
+    audio_seconds: Optional[float] = None  # длительность распознаваемого аудио, если известна
+    error: Optional[str] = None  # класс исключения, если запрос упал
 
 
 class OpenAIClient:
@@ -10,88 +51,282 @@ class OpenAIClient:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise RuntimeError("OPENAI_API_KEY is not set in .env")
-        self.client = OpenAI(api_key=api_key)
+        # Таймауты по умолчанию (сек); каждый вызов может передать свой
+        self.timeout = float(os.getenv("OPENAI_TIMEOUT", "60"))
+        self.stt_timeout = float(os.getenv("OPENAI_STT_TIMEOUT", "180"))
+        # Длинное аудио: окна по STT_SEGMENT_SECONDS с перекрытием, не больше STT_WORKERS запросов разом
+        self.stt_segment = float(os.getenv("STT_SEGMENT_SECONDS", "300"))
+        self.stt_overlap = float(os.getenv("STT_SEGMENT_OVERLAP", "3"))
+        self.stt_workers = int(os.getenv("STT_WORKERS", "4"))
+        # Один общий пул соединений на весь бот: keep-alive между запросами,
+        # параллельные генерации не открывают каждый раз новое TLS-соединение
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "10")),
+            ),
+            timeout=self.timeout,
+        )
+        self.client = AsyncOpenAI(api_key=api_key, http_client=self.http_client, timeout=self.timeout)
         self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        # Готовые шаблоны промптов; вход длиннее PROMPT_INPUT_TOKENS урезается (0 — не урезать)
+        self.prompts = PromptBuilder(self.model, input_budget=int(os.getenv("PROMPT_INPUT_TOKENS", "3000")))
+        # Генерация: повторы, дедлайн, запасной запрос и предохранитель — в Resilience, без ретраев SDK
+        self.chat = self.client.with_options(max_retries=0).chat
+        self.fallback_model = os.getenv("OPENAI_FALLBACK_MODEL") or None
+        self.resilience = Resilience(
+            [self.model, self.fallback_model],
+            retryable=_retryable,
+            deadline=float(os.getenv("OPENAI_DEADLINE", str(self.timeout))),
+            hedge=os.getenv("OPENAI_HEDGE", "1") != "0",
+            hedge_min=float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "1")),
+            max_attempts=int(os.getenv("OPENAI_MAX_ATTEMPTS", "3")),
+            breaker_failures=int(os.getenv("OPENAI_BREAKER_FAILURES", "5")),
+            breaker_reset=float(os.getenv("OPENAI_BREAKER_RESET", "30")),
+        )
         # чуть теплее, чтобы стиль был живее
         self.temperature = float(os.getenv("OPENAI_TEMPERATURE", "0.9"))
+        # Кэш одинаковых запросов; OPENAI_CACHE_SIZE=0 — выключить
+        cache_size = int(os.getenv("OPENAI_CACHE_SIZE", "256"))
+        self.cache: Optional[GenerationCache] = None
+        if cache_size > 0:
+            self.cache = GenerationCache(
+                max_items=cache_size,
+                ttl=float(os.getenv("OPENAI_CACHE_TTL", "86400")),
+                path=os.getenv("OPENAI_CACHE_PATH") or None,
+            )
+        # Наблюдатель за запросами к API (метрики); попадания в кэш сюда не попадают
+        self.on_call: Optional[Callable[[CallStats], None]] = None
 
-    def generate_post_from_text(self, text: str, verbosity: Optional[str] = None) -> str:
-        """Генерирует пост в стиле менеджера команды. verbosity: short|medium|long."""
-        verbosity_rules = {
-            "short": "Сделай короткий пост: 1–2 предложения, без буллетов и без хэштегов.",
-            "medium": "Сделай компактный пост: 2–4 предложения, без хэштегов.",
-            "long": (
-                "Сделай развернутый пост в стиле сжатого отчёта: 3–6 коротких строк. "
-                "Разбей на строки по смыслу (например, как пункты), можно начать строки с уместных эмодзи, но без хэштегов."
-            ),
-        }
-        length_hint = verbosity_rules.get(verbosity or "", "Подстрой длину поста под объём входного текста.")
-        system_prompt = (
-            "Ты — менеджер симрейсинг-команды и пишешь живые посты для Telegram. "
-            "Пиши простым языком, без канцелярита и без пафоса, 0–2 эмодзи. "
-            "Фокус: команда, трасса, формат/симулятор/авто/пилоты/результат — только если есть во входе. Не придумывай факты. "
-            "Не добавляй в конце поста таймстампы/даты вида ‘9 августа, 13:37’. "
-            f"{length_hint}"
-        )
-        resp = self.client.chat.completions.create(
-            model=self.model,
-            temperature=self.temperature,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Создай пост по информации:\n\n{text}"},
-            ],
-            n=1,
-        )
-        return (resp.choices[0].message.content or "").strip()
-
-    def generate_post_in_style(self, text: str, style: str, verbosity: Optional[str] = None) -> str:
-        """Перегенерирует пост в выбранном стиле: classic|funny|report. verbosity: short|medium|long."""
-        styles = {
-            "classic": "классический спортивный стиль",
-            "funny": "шуточный, но уместный, без сарказма",
-            "report": "сдержанный репортажный стиль",
-        }
-        style_desc = styles.get(style, "классический спортивный стиль")
-        verbosity_rules = {
-            "short": "1–2 предложения, без буллетов.",
-            "medium": "2–4 предложения.",
-            "long": "3–6 коротких строк, допускаются строки с эмодзи в начале.",
-        }
-        length_hint = verbosity_rules.get(verbosity or "", "Подстрой длину под объём входного текста.")
-        system_prompt = (
-            f"Ты — менеджер симрейсинг-команды. Стиль: {style_desc}. "
-            "Пиши по-человечески, без пафоса. "
-            f"{length_hint} "
-            "Не добавляй в конце поста таймстампы/даты вида ‘9 августа, 13:37’."
-        )
-        resp = self.client.chat.completions.create(
+    def _report(self, kind: str, model: str, started: float, usage=None,
+                error: Optional[BaseException] = None, audio_seconds: Optional[float] = None,
+                prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None) -> None:
+        """usage — из ответа API; без него можно передать prompt_tokens/completion_tokens, посчитанные локально."""
+        if not self.on_call:
+            return
+        self.on_call(CallStats(
+            kind=kind,
+            model=model,
+            duration=time.perf_counter() - started,
+            prompt_tokens=usage.prompt_tokens if usage else prompt_tokens,
+            completion_tokens=usage.completion_tokens if usage else completion_tokens,
+            audio_seconds=audio_seconds,
+            error=type(error).__name__ if error else None,
+        ))
+
+    async def aclose(self) -> None:
+        """Закрывает пул соединений и кэш (вызывать при остановке бота)."""
+        await self.client.close()
+        if self.cache:
+            self.cache.close()
+
+    async def warm_up(self, timeout: float = 10) -> None:
+        """Открывает соединение с API заранее (DNS, TLS), чтобы первая генерация не платила за handshake:
+        лёгкий запрос к /models, соединение остаётся в пуле keep-alive."""
+        # Без ретраев: прогрев необязателен, недоступный API не должен держать его минутами
+        await self.client.with_options(max_retries=0).models.retrieve(self.model, timeout=timeout)
+
+    def _cache_key(self, messages: List[dict], style: Optional[str], verbosity: Optional[str]) -> str:
+        return make_key(
             model=self.model,
             temperature=self.temperature,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Информация для поста:\n\n{text}"},
-            ],
-            n=1,
+            system=messages[0]["content"],
+            user=messages[1]["content"],
+            style=style,
+            verbosity=verbosity,
         )
-        return (resp.choices[0].message.content or "").strip()
-
-    def transcribe(self, file_bytes: bytes, filename: str = "audio.ogg", language: str = "ru") -> Optional[str]:
-        """Транскрибирует аудио в текст (Whisper). Возвращает распознанный текст или None."""
-        # Сохраняем во временный файл, так надёжнее для клиента
-        suffix = Path(filename).suffix or ".ogg"
-        with tempfile.NamedTemporaryFile(delete=True, suffix=suffix) as tmp:
-            tmp.write(file_bytes)
-            tmp.flush()
+
+    def _cached(self, key: str, force_fresh: bool) -> Optional[str]:
+        if not self.cache or force_fresh:
+            return None
+        return self.cache.get(key)
+
+    def _store(self, key: str, text: str) -> None:
+        if self.cache and text:
+            self.cache.set(key, text)
+
+    async def _complete(self, kind: str, messages: List[dict], timeout: Optional[float], **extra):
+        """chat.completions через Resilience: каждая попытка (в т.ч. запасная и на OPENAI_FALLBACK_MODEL)
+        попадает в on_call со своей моделью; timeout — дедлайн на весь вызов вместе с повторами."""
+
+        async def attempt(model: str, attempt_timeout: float):
+            started = time.perf_counter()
+            try:
+                resp = await self.chat.completions.create(
+                    model=model,
+                    temperature=self.temperature,
+                    messages=messages,
+                    n=1,
+                    timeout=attempt_timeout,
+                    **extra,
+                )
+            except BaseException as e:
+                # Отменённая запасная попытка тоже видна в метриках (CancelledError)
+                self._report(kind, model, started, error=e)
+                raise
+            self._report(kind, model, started, usage=resp.usage)
+            return resp
+
+        _, resp = await self.resilience.call(kind, attempt, deadline=timeout)
+        return resp
+
+    async def generate_post_from_text(self, text: str, verbosity: Optional[str] = None,
+                                      timeout: Optional[float] = None, force_fresh: bool = False) -> str:
+        """Генерирует пост в стиле менеджера команды. verbosity: short|medium|long.
+        force_fresh=True — не брать ответ из кэша (результат всё равно обновит кэш)."""
+        messages = self.prompts.post_messages(self.prompts.fit(text)[0], verbosity)
+        key = self._cache_key(messages, None, verbosity)
+        cached = self._cached(key, force_fresh)
+        if cached is not None:
+            return cached
+        resp = await self._complete("generate", messages, timeout)
+        post = (resp.choices[0].message.content or "").strip()
+        self._store(key, post)
+        return post
+
+    async def stream_post_from_text(self, text: str, verbosity: Optional[str] = None,
+                                    timeout: Optional[float] = None, force_fresh: bool = False) -> AsyncIterator[str]:
+        """То же, что generate_post_from_text, но отдаёт текст кусочками по мере генерации (stream=True)."""
+        messages = self.prompts.post_messages(self.prompts.fit(text)[0], verbosity)
+        key = self._cache_key(messages, None, verbosity)
+        cached = self._cached(key, force_fresh)
+        if cached is not None:
+            yield cached
+            return
+
+        async def open_stream(model: str, attempt_timeout: float) -> tuple:
+            # Попытка считается ответившей с первым куском текста: запасной запрос страхует именно его
+            started = time.perf_counter()
             try:
-                resp = self.client.audio.transcriptions.create(
-                    model=os.getenv("OPENAI_STT_MODEL", "whisper-1"),
-                    file=Path(tmp.name),
-                    language=language,
-                    response_format="text",
+                stream = await self.chat.completions.create(
+                    model=model,
+                    temperature=self.temperature,
+                    messages=messages,
+                    n=1,
+                    stream=True,
+                    timeout=attempt_timeout,
                 )
-                # resp is str when response_format="text"
-                text = str(resp).strip()
-                return text or None
-            except Exception:
-                return None
+            except BaseException as e:
+                self._report("stream", model, started, error=e)
+                raise
+            chunks = stream.__aiter__()
+            try:
+                first = await _first_delta(chunks)
+            except BaseException as e:
+                await stream.close()
+                self._report("stream", model, started, error=e)
+                raise
+            return stream, chunks, first, started
+
+        model, (stream, chunks, first, started) = await self.resilience.call(
+            "stream", open_stream, deadline=timeout, discard=_close_stream,
+        )
+        parts: List[str] = []
+        try:
+            # async with закрывает соединение, даже если потребитель прервал чтение (отмена/ошибка)
+            async with stream:
+                if first:
+                    parts.append(first)
+                    yield first
+                async for chunk in chunks:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+        except Exception as e:
+            self._report("stream", model, started, error=e)
+            raise
+        post = "".join(parts).strip()
+        # Usage в потоке SDK 1.12 не отдаёт — расход считаем сами по тем же сообщениям
+        self._report("stream", model, started, prompt_tokens=self.prompts.count_messages(messages),
+                     completion_tokens=self.prompts.count(post))
+        # В кэш попадает только полностью дочитанный ответ
+        self._store(key, post)
+
+    async def generate_post_in_style(self, text: str, style: str, verbosity: Optional[str] = None,
+                                     timeout: Optional[float] = None, max_tokens: Optional[int] = None,
+                                     on_usage: Optional[Callable[[int], None]] = None,
+                                     force_fresh: bool = False) -> str:
+        """Перегенерирует пост в выбранном стиле: classic|funny|report. verbosity: short|medium|long.
+        max_tokens ограничивает длину ответа; on_usage получает фактический расход токенов (prompt + completion).
+        force_fresh=True — не брать ответ из кэша."""
+        messages = self.prompts.style_messages(self.prompts.fit(text)[0], style, verbosity)
+        key = self._cache_key(messages, style, verbosity)
+        cached = self._cached(key, force_fresh)
+        if cached is not None:
+            return cached
+        extra = {"max_tokens": max_tokens} if max_tokens else {}
+        resp = await self._complete("style", messages, timeout, **extra)
+        if on_usage and resp.usage:
+            on_usage(resp.usage.total_tokens)
+        post = (resp.choices[0].message.content or "").strip()
+        self._store(key, post)
+        return post
+
+    async def transcribe(self, audio: AudioInput, filename: str = "audio.ogg", language: str = "ru",
+                         timeout: Optional[float] = None, duration: Optional[float] = None) -> Optional[str]:
+        """Транскрибирует аудио в текст (Whisper). Возвращает распознанный текст или None.
+        audio — bytes, файловый объект (например, BytesIO из загрузки Telegram) или кортеж (имя файла, файл).
+        Файл передаётся в запрос как есть: без временного файла и без лишней копии в памяти.
+        duration (сек) нужна только для метрик — время распознавания на секунду аудио."""
+        try:
+            return await self._transcribe_raw(audio, filename, language, timeout, duration) or None
+        except Exception:
+            return None
+
+    async def _transcribe_raw(self, audio: AudioInput, filename: str, language: str,
+                              timeout: Optional[float], duration: Optional[float]) -> str:
+        """Один запрос к Whisper; ошибки пробрасываются, пустая строка — в аудио нет речи."""
+        # Имя файла нужно Whisper для определения формата по расширению
+        file = audio if isinstance(audio, tuple) else (filename, audio)
+        model = os.getenv("OPENAI_STT_MODEL", "whisper-1")
+        started = time.perf_counter()
+        try:
+            resp = await self.client.audio.transcriptions.create(
+                model=model,
+                file=file,
+                language=language,
+                response_format="text",
+                timeout=timeout or self.stt_timeout,
+            )
+        except Exception as e:
+            self._report("transcribe", model, started, error=e, audio_seconds=duration)
+            raise
+        self._report("transcribe", model, started, audio_seconds=duration)
+        # resp is str when response_format="text"
+        return str(resp).strip()
+
+    async def transcribe_long(self, audio: Union[bytes, io.BytesIO], duration: float, filename: str = "audio.ogg",
+                              language: str = "ru") -> Optional[str]:
+        """Распознаёт длинное аудио: режет на перекрывающиеся окна, отправляет их параллельно
+        и склеивает текст по порядку. Если ffmpeg недоступен или хоть одно окно не удалось
+        (ошибка ffmpeg или API) — обычный transcribe одним запросом: расшифровка с дырой посередине
+        хуже, чем более медленная целая. Файлы из Telegram (до 20 МБ) укладываются в лимит API (25 МБ)."""
+        starts = segment_starts(duration, self.stt_segment, self.stt_overlap)
+        if len(starts) == 1 or not ffmpeg_available():
+            if len(starts) > 1:
+                logger.warning("ffmpeg not found, transcribing %.0fs of audio in one request", duration)
+            return await self.transcribe(audio, filename=filename, language=language, duration=duration)
+
+        workers = asyncio.Semaphore(self.stt_workers)
+
+        async def transcribe_segment(data: memoryview, start: float) -> str:
+            async with workers:
+                segment = await cut_segment(data, start, self.stt_segment)
+                length = min(self.stt_segment, duration - start)
+                return await self._transcribe_raw(("segment.flac", segment), "segment.flac", language,
+                                                  None, length)
 
+        # Работаем прямо с буфером загрузки, без копии
+        view = memoryview(audio) if isinstance(audio, bytes) else audio.getbuffer()
+        with view:
+            parts = await asyncio.gather(*(transcribe_segment(view, start) for start in starts),
+                                         return_exceptions=True)
+        errors = [p for p in parts if isinstance(p, BaseException)]
+        if errors:
+            logger.warning("%d of %d audio segments failed (%s), transcribing in one request",
+                           len(errors), len(parts), errors[0])
+            return await self.transcribe(audio, filename=filename, language=language, duration=duration)
+        return stitch(parts)
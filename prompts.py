@@ -0,0 +1,135 @@
+import logging
+import math
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Тексты промптов те же, что раньше собирались на каждый вызов; теперь готовые system-сообщения
+# строятся один раз при импорте — на вызов остаётся поиск в словаре и подстановка текста
+STYLES = {
+    "classic": "классический спортивный стиль",
+    "funny": "шуточный, но уместный, без сарказма",
+    "report": "сдержанный репортажный стиль",
+}
+
+_POST_LENGTHS = {
+    "short": "Сделай короткий пост: 1–2 предложения, без буллетов и без хэштегов.",
+    "medium": "Сделай компактный пост: 2–4 предложения, без хэштегов.",
+    "long": (
+        "Сделай развернутый пост в стиле сжатого отчёта: 3–6 коротких строк. "
+        "Разбей на строки по смыслу (например, как пункты), можно начать строки с уместных эмодзи, но без хэштегов."
+    ),
+    None: "Подстрой длину поста под объём входного текста.",
+}
+_STYLE_LENGTHS = {
+    "short": "1–2 предложения, без буллетов.",
+    "medium": "2–4 предложения.",
+    "long": "3–6 коротких строк, допускаются строки с эмодзи в начале.",
+    None: "Подстрой длину под объём входного текста.",
+}
+
+_POST_SYSTEM = {
+    verbosity: (
+        "Ты — менеджер симрейсинг-команды и пишешь живые посты для Telegram. "
+        "Пиши простым языком, без канцелярита и без пафоса, 0–2 эмодзи. "
+        "Фокус: команда, трасса, формат/симулятор/авто/пилоты/результат — только если есть во входе. Не придумывай факты. "
+        "Не добавляй в конце поста таймстампы/даты вида ‘9 августа, 13:37’. "
+        f"{hint}"
+    )
+    for verbosity, hint in _POST_LENGTHS.items()
+}
+_STYLE_SYSTEM = {
+    (style, verbosity): (
+        f"Ты — менеджер симрейсинг-команды. Стиль: {desc}. "
+        "Пиши по-человечески, без пафоса. "
+        f"{hint} "
+        "Не добавляй в конце поста таймстампы/даты вида ‘9 августа, 13:37’."
+    )
+    for style, desc in STYLES.items()
+    for verbosity, hint in _STYLE_LENGTHS.items()
+}
+_CUT_MARK = "\n…\n"
+
+# Без tiktoken: ~3 символа на токен — для русского текста оценка с запасом
+_CHARS_PER_TOKEN = 3
+# Служебные токены на каждое сообщение и на начало ответа (формат chat.completions)
+_MESSAGE_OVERHEAD = 4
+_REPLY_OVERHEAD = 3
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """Токенизатор модели, если установлен tiktoken (и его словарь скачивается); иначе None — считаем оценкой."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("tiktoken unavailable for %s (%s), using estimate", model, e)
+        return None
+
+
+class PromptBuilder:
+    """Сообщения для генерации постов из заранее собранных шаблонов. Считает токены локально
+    (tiktoken, если есть) и урезает слишком длинный вход до input_budget."""
+
+    def __init__(self, model: str, input_budget: int = 3000):
+        self.model = model
+        self.input_budget = input_budget
+        self.truncated = 0
+
+    def count(self, text: str) -> int:
+        encoding = _encoding(self.model)
+        if encoding is not None:
+            return len(encoding.encode(text or ""))
+        return math.ceil(len(text or "") / _CHARS_PER_TOKEN)
+
+    def count_messages(self, messages: List[dict]) -> int:
+        return sum(self.count(m["content"]) + _MESSAGE_OVERHEAD for m in messages) + _REPLY_OVERHEAD
+
+    def fit(self, text: str) -> Tuple[str, bool]:
+        """Урезает текст до input_budget токенов: начало (там обычно главное) и хвост (итог), середина
+        выбрасывается. Возвращает (текст, был ли урезан)."""
+        if self.input_budget <= 0 or self.count(text) <= self.input_budget:
+            return text, False
+        self.truncated += 1
+        head_budget = self.input_budget * 3 // 4
+        tail_budget = self.input_budget - head_budget
+        encoding = _encoding(self.model)
+        if encoding is not None:
+            tokens = encoding.encode(text)
+            head, tail = encoding.decode(tokens[:head_budget]), encoding.decode(tokens[-tail_budget:])
+        else:
+            head = text[:head_budget * _CHARS_PER_TOKEN]
+            tail = text[-tail_budget * _CHARS_PER_TOKEN:]
+        # Режем по границе слова, чтобы не оставлять обрывков
+        head = head.rsplit(None, 1)[0] if " " in head else head
+        tail = tail.split(None, 1)[-1] if " " in tail else tail
+        logger.info("Input truncated to %d tokens (was %d chars)", self.input_budget, len(text))
+        return head + _CUT_MARK + tail, True
+
+    def post_messages(self, text: str, verbosity: Optional[str] = None) -> List[dict]:
+        system = _POST_SYSTEM.get(verbosity, _POST_SYSTEM[None])
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": f"Создай пост по информации:\n\n{text}"},
+        ]
+
+    def style_messages(self, text: str, style: str, verbosity: Optional[str] = None) -> List[dict]:
+        if style not in STYLES:
+            style = "classic"
+        system = _STYLE_SYSTEM.get((style, verbosity), _STYLE_SYSTEM[(style, None)])
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": f"Информация для поста:\n\n{text}"},
+        ]
+
+    def warm_up(self) -> None:
+        """Загружает словарь tiktoken заранее (первый раз он скачивается), чтобы его не ждала генерация."""
+        self.count("прогрев")
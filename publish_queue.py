@@ -0,0 +1,197 @@
+import asyncio
+import heapq
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Начало отсчёта id заданий (2024-01-01 UTC): id короче, а callback_data кнопок укладывается в 64 байта
+_JOB_EPOCH_MS = 1_704_067_200_000
+
+
+@dataclass(slots=True)
+class Job:
+    """Отложенная публикация: payload — сериализованный черновик (Session.to_json)."""
+    id: int
+    owner: int
+    due_at: float  # unix-время
+    payload: str
+    attempts: int = 0
+
+
+class PublishQueue:
+    """Очередь отложенных публикаций: куча по времени в памяти + таблица SQLite (если задан path).
+
+    Одна фоновая задача спит до ближайшего срока (или до добавления более раннего задания) —
+    без отдельной корутины на каждое задание и без опроса по таймеру. После рестарта задания
+    поднимаются с диска, пропущенные публикуются сразу; опоздавшие больше чем на max_late —
+    не публикуются (анонс уже неактуален) и уходят в on_drop."""
+
+    # Дольше не спим даже без заданий на горизонте: страховка от перевода системных часов
+    _MAX_SLEEP = 300.0
+
+    def __init__(self, path: Optional[str] = None, max_late: float = 6 * 3600,
+                 max_attempts: int = 3, retry_delay: float = 60):
+        self.max_late = max_late
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._jobs: Dict[int, Job] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._last_id = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._conn = sqlite3.connect(path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS publish_jobs ("
+                "id INTEGER PRIMARY KEY, owner INTEGER NOT NULL, due_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, payload TEXT NOT NULL)"
+            )
+            for row in self._conn.execute("SELECT id, owner, due_at, attempts, payload FROM publish_jobs"):
+                job = Job(id=row[0], owner=row[1], due_at=row[2], attempts=row[3], payload=row[4])
+                self._push(job)
+            self._last_id = max(self._jobs, default=0)
+            if self._jobs:
+                logger.info("Loaded %d scheduled posts", len(self._jobs))
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._firing: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._on_fire: Optional[Callable[[Job], Awaitable[None]]] = None
+        self._on_drop: Optional[Callable[[Job, str], Awaitable[None]]] = None
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def _new_id(self) -> int:
+        # Миллисекунды от _JOB_EPOCH_MS, строго возрастающие: id сработавших и отменённых заданий
+        # не достаются новым и после рестарта, так что старая кнопка «Отменить» не попадёт в чужое задание
+        self._last_id = max(self._last_id + 1, int(time.time() * 1000) - _JOB_EPOCH_MS)
+        return self._last_id
+
+    def add(self, owner: int, due_at: float, payload: str) -> Job:
+        job = Job(id=self._new_id(), owner=owner, due_at=due_at, payload=payload)
+        if self._conn is not None:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO publish_jobs (id, owner, due_at, attempts, payload) VALUES (?, ?, ?, ?, ?)",
+                    (job.id, job.owner, job.due_at, job.attempts, job.payload),
+                )
+        self._push(job)
+        # Будим планировщик: новое задание может оказаться раньше того, до которого он спит
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: int) -> Optional[Job]:
+        """Снимает задание; None — если его нет или оно уже публикуется."""
+        if job_id == self._firing:
+            return None
+        # Из кучи не удаляем: устаревшая запись отбрасывается, когда дойдёт до вершины
+        job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._delete(job)
+        return job
+
+    def pending(self, owner: Optional[int] = None) -> List[Job]:
+        jobs = [j for j in self._jobs.values() if owner is None or j.owner == owner]
+        return sorted(jobs, key=lambda j: (j.due_at, j.id))
+
+    def start(self, on_fire: Callable[[Job], Awaitable[None]], on_drop: Callable[[Job, str], Awaitable[None]]) -> None:
+        """on_fire(job) публикует; исключение — повтор через retry_delay * попытка, после max_attempts
+        задание снимается с on_drop(job, причина). Причина 'expired' — слишком сильно опоздали."""
+        self._on_fire = on_fire
+        self._on_drop = on_drop
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 30) -> None:
+        """Даёт дописать текущую публикацию (не дольше timeout) и останавливает планировщик.
+        Оставшиеся задания лежат на диске и сработают после рестарта."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Scheduled publish interrupted by shutdown")
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _push(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        heapq.heappush(self._heap, (job.due_at, job.id))
+
+    def _peek(self) -> Optional[Job]:
+        while self._heap:
+            due_at, job_id = self._heap[0]
+            job = self._jobs.get(job_id)
+            if job is not None and job.due_at == due_at:
+                return job
+            heapq.heappop(self._heap)  # отменённое или перенесённое задание
+        return None
+
+    def _delete(self, job: Job) -> None:
+        if self._conn is not None:
+            with self._conn:
+                self._conn.execute("DELETE FROM publish_jobs WHERE id = ?", (job.id,))
+
+    async def _run(self) -> None:
+        while not self._closing:
+            self._wakeup.clear()
+            job = self._peek()
+            delay = self._MAX_SLEEP if job is None else min(job.due_at - time.time(), self._MAX_SLEEP)
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            await self._fire(job)
+
+    async def _fire(self, job: Job) -> None:
+        late = time.time() - job.due_at
+        if late > self.max_late:
+            self._finish(job)
+            await self._drop(job, "expired")
+            return
+        self._firing = job.id
+        try:
+            await self._on_fire(job)
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts >= self.max_attempts:
+                logger.exception("Scheduled post %s failed, giving up", job.id)
+                self._finish(job)
+                await self._drop(job, str(e))
+                return
+            delay = self.retry_delay * job.attempts
+            logger.warning("Scheduled post %s failed (%s), retry in %.0fs", job.id, e, delay)
+            job.due_at = time.time() + delay
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE publish_jobs SET due_at = ?, attempts = ? WHERE id = ?",
+                        (job.due_at, job.attempts, job.id),
+                    )
+            heapq.heappush(self._heap, (job.due_at, job.id))
+            return
+        finally:
+            self._firing = None
+        self._finish(job)
+
+    def _finish(self, job: Job) -> None:
+        if self._jobs.pop(job.id, None) is not None:
+            self._delete(job)
+
+    async def _drop(self, job: Job, reason: str) -> None:
+        try:
+            await self._on_drop(job, reason)
+        except Exception:
+            logger.exception("on_drop failed for scheduled post %s", job.id)
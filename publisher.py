@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramEntityTooLarge,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from media import MediaItem, caption_fits
+
+logger = logging.getLogger(__name__)
+
+ChatId = Union[int, str]
+# Наблюдатель за отправками: (метод, латентность в сек, число попыток, ошибка или None)
+SendHook = Callable[[str, float, int, Optional[BaseException]], None]
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше burst подряд."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # Лок держит очередь ожидающих в порядке FIFO
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Flood-wait от Telegram: до его окончания в этот чат ничего не отправляем."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+@dataclass(slots=True)
+class SendStep:
+    """Один вызов Bot API при публикации: имя метода Bot и его аргументы без chat_id."""
+    method: str
+    kwargs: Dict[str, Any]
+
+
+@dataclass(slots=True)
+class SendReport:
+    method: str
+    latency: float  # сек, от первой попытки до ответа (включая ожидание ретраев)
+    attempts: int
+    message_ids: List[int] = field(default_factory=list)
+
+
+class PublishError(Exception):
+    """Публикация прервалась на шаге step; reports — успешно отправленные шаги до него."""
+
+    def __init__(self, step: SendStep, cause: Exception, reports: List[SendReport]):
+        super().__init__(str(cause))
+        self.step = step
+        self.cause = cause
+        self.reports = reports
+
+
+def build_plan(post_text: str, media: List[MediaItem]) -> List[SendStep]:
+    """Раскладывает пост на вызовы Bot API за один проход по готовым записям MediaItem:
+    одиночное фото/видео — с подписью, несколько — альбомом (подпись у первого), аудио/voice —
+    отдельными сообщениями после. Текст длиннее подписи уходит отдельным сообщением за медиа."""
+    album = [m for m in media if m.in_album]
+    caption = post_text if caption_fits(post_text, album) else None
+
+    steps: List[SendStep] = []
+    if not album:
+        steps.append(SendStep('send_message', {'text': post_text}))
+    elif len(album) == 1:
+        item = album[0]
+        steps.append(SendStep(f'send_{item.kind}', {item.kind: item.file_id, 'caption': caption}))
+    else:
+        media_group = [m.input_media(caption if i == 0 else None) for i, m in enumerate(album)]
+        steps.append(SendStep('send_media_group', {'media': media_group}))
+    if album and caption is None:
+        steps.append(SendStep('send_message', {'text': post_text}))
+    # Аудио/войс отправляем отдельно (без альбома)
+    for m in media:
+        if not m.in_album:
+            steps.append(SendStep(f'send_{m.kind}', {m.kind: m.file_id}))
+    return steps
+
+
+def publish_key(owner: Any, steps: List[SendStep]) -> str:
+    """Ключ идемпотентности: owner — то, что публикуется (черновик, задание очереди), а не только автор,
+    иначе тот же текст того же админа в другом черновике считался бы уже отправленным."""
+    raw = json.dumps(
+        [owner, [(s.method, s.kwargs) for s in steps]],
+        default=lambda o: o.model_dump() if hasattr(o, 'model_dump') else str(o),
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class Publisher:
+    """Отправка постов с учётом лимитов Telegram.
+
+    - в каждый чат — свой token bucket (плюс общий на бота), flood-wait (RetryAfter) ставит чат на паузу;
+    - шаги поста уходят строго по порядку, посты разных админов в один чат — по очереди, не вперемешку;
+      разные чаты обслуживаются параллельно;
+    - сетевые/5xx ошибки и RetryAfter повторяются с backoff;
+    - повтор после частичной ошибки с тем же ключом не дублирует сообщения: уже отправленные шаги
+      пропускаются, одновременные нажатия ждут одну и ту же публикацию. После полного успеха ключ
+      забывается — следующая публикация с ним отправляет пост заново."""
+
+    def __init__(self, bot: Bot, per_chat_per_min: float = 20, burst: int = 5,
+                 global_per_sec: float = 30, max_attempts: int = 5,
+                 dedup_ttl: float = 600, dedup_size: int = 1000, on_send: Optional[SendHook] = None):
+        self.bot = bot
+        self.on_send = on_send
+        self.per_chat_rate = per_chat_per_min / 60
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.dedup_ttl = dedup_ttl
+        self.dedup_size = dedup_size
+        self._global = TokenBucket(global_per_sec, int(global_per_sec))
+        self._buckets: Dict[ChatId, TokenBucket] = {}
+        self._chat_locks: Dict[ChatId, asyncio.Lock] = {}
+        # (key, chat_id) → (время последнего шага, отчёты по отправленным шагам)
+        self._progress: "OrderedDict[Tuple[str, ChatId], Tuple[float, List[SendReport]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, ChatId], asyncio.Task] = {}
+
+    async def publish(self, chat_id: ChatId, steps: List[SendStep], key: str) -> List[SendReport]:
+        slot = (key, chat_id)
+        task = self._inflight.get(slot)
+        if task is None:
+            task = asyncio.create_task(self._publish(chat_id, steps, slot))
+            self._inflight[slot] = task
+            task.add_done_callback(lambda t: self._on_done(slot, t))
+        # shield: если ждущий обработчик отменят, публикация для остальных не прервётся
+        return await asyncio.shield(task)
+
+    async def publish_many(self, chat_ids: List[ChatId], steps: List[SendStep], key: str,
+                           concurrency: int = 4) -> Dict[ChatId, Union[List[SendReport], BaseException]]:
+        """Публикует один пост сразу в несколько чатов, не больше concurrency одновременно.
+        Возвращает итог по каждому чату: отчёты об отправке или исключение."""
+        limit = asyncio.Semaphore(concurrency)
+
+        async def publish_one(chat_id: ChatId) -> List[SendReport]:
+            async with limit:
+                return await self.publish(chat_id, steps, key)
+
+        results = await asyncio.gather(*(publish_one(c) for c in chat_ids), return_exceptions=True)
+        return dict(zip(chat_ids, results))
+
+    def _on_done(self, slot: Tuple[str, ChatId], task: asyncio.Task) -> None:
+        self._inflight.pop(slot, None)
+        if not task.cancelled():
+            task.exception()  # ошибку получат ждущие; здесь только помечаем её прочитанной
+
+    async def _publish(self, chat_id: ChatId, steps: List[SendStep], slot: Tuple[str, ChatId]) -> List[SendReport]:
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            reports = self._resume(slot)
+            for step in steps[len(reports):]:
+                try:
+                    reports.append(await self._send(chat_id, step))
+                except Exception as e:
+                    raise PublishError(step, e, list(reports)) from e
+                finally:
+                    self._remember(slot, reports)
+            # Всё отправлено: прогресс нужен был только для продолжения после ошибки
+            self._progress.pop(slot, None)
+            return list(reports)
+
+    def _resume(self, slot: Tuple[str, ChatId]) -> List[SendReport]:
+        record = self._progress.get(slot)
+        if record is None or record[0] < time.monotonic() - self.dedup_ttl:
+            return []
+        if record[1]:
+            logger.info("Resuming publish to %s after %d sent steps", slot[1], len(record[1]))
+        return list(record[1])
+
+    def _remember(self, slot: Tuple[str, ChatId], reports: List[SendReport]) -> None:
+        self._progress[slot] = (time.monotonic(), list(reports))
+        self._progress.move_to_end(slot)
+        while len(self._progress) > self.dedup_size:
+            self._progress.popitem(last=False)
+
+    def _bucket(self, chat_id: ChatId) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.per_chat_rate, self.burst)
+        return bucket
+
+    async def _send(self, chat_id: ChatId, step: SendStep) -> SendReport:
+        bucket = self._bucket(chat_id)
+        method = getattr(self.bot, step.method)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                result = await method(chat_id=chat_id, **step.kwargs)
+            except Exception as e:
+                retry_in = self._retry_delay(e, attempt)
+                if retry_in is None:
+                    self._observe(step.method, started, attempt, e)
+                    raise
+                if isinstance(e, TelegramRetryAfter):
+                    logger.warning("Flood wait %ss on %s in %s", e.retry_after, step.method, chat_id)
+                    bucket.pause(retry_in)
+                else:
+                    logger.warning("%s to %s failed (%s), retry in %.1fs", step.method, chat_id, e, retry_in)
+                    await asyncio.sleep(retry_in)
+                continue
+            latency = self._observe(step.method, started, attempt, None)
+            messages = result if isinstance(result, list) else [result]
+            report = SendReport(step.method, latency, attempt, [m.message_id for m in messages])
+            logger.info("Sent %s to %s in %.0f ms (attempts: %d)", step.method, chat_id, latency * 1000, attempt)
+            return report
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Через сколько секунд повторить отправку; None — не повторять."""
+        if attempt >= self.max_attempts or isinstance(error, TelegramEntityTooLarge):
+            return None
+        if isinstance(error, TelegramRetryAfter):
+            return error.retry_after
+        if isinstance(error, (TelegramNetworkError, TelegramServerError)):
+            return min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+        return None
+
+    def _observe(self, method: str, started: float, attempts: int, error: Optional[BaseException]) -> float:
+        latency = time.monotonic() - started
+        if self.on_send:
+            self.on_send(method, latency, attempts, error)
+        return latency
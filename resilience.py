@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+# Одна попытка: (модель, таймаут в секундах) → результат
+Attempt = Callable[[str, float], Awaitable[T]]
+
+
+class DeadlineExceeded(TimeoutError):
+    """Ни одна попытка не уложилась в общий дедлайн вызова."""
+
+
+class CircuitOpen(RuntimeError):
+    """Все модели временно выключены предохранителем — запрос не отправляется."""
+
+
+class CircuitBreaker:
+    """Предохранитель одной модели: после failures ошибок подряд модель выключается на reset_after сек,
+    затем пропускается одна пробная попытка — успех включает модель, ошибка снова выключает."""
+
+    def __init__(self, failures: int = 5, reset_after: float = 30):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._errors = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_after
+
+    def retry_in(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_after - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Можно ли слать запрос: модель включена или пора пробной попытки, которая ещё не идёт."""
+        if self._opened_at is None:
+            return True
+        return not self.is_open and not self._probing
+
+    def begin(self) -> None:
+        if self._opened_at is not None:
+            self._probing = True  # полуоткрыт: одна пробная попытка
+
+    def success(self) -> None:
+        if self._opened_at is not None:
+            logger.info("Circuit closed")
+        self._errors = 0
+        self._opened_at = None
+        self._probing = False
+
+    def failure(self) -> None:
+        self._errors += 1
+        if self._probing or self._errors >= self.failures:
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """Пробная попытка отменена без результата — пропустить следующую."""
+        self._probing = False
+
+
+class LatencyWindow:
+    """Последние window времён ответа — по ним выбирается момент для запасного запроса."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._values: Deque[float] = deque(maxlen=window)
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._values) < self.min_samples:
+            return None
+        ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Resilience:
+    """Обёртка вызовов модели:
+
+    - общий дедлайн на вызов: каждая попытка получает остаток времени как таймаут;
+    - hedging: если первая попытка не ответила за p95 обычного времени ответа, параллельно уходит
+      вторая (на запасную модель, если она задана) — берём ответ, пришедший первым, второй отменяем;
+    - повтор временных ошибок (сеть, 429, 5xx) с экспоненциальной задержкой и jitter;
+    - предохранитель на каждую модель: выключенная модель пропускается, запросы идут на запасную."""
+
+    def __init__(self, models: List[str], retryable: Callable[[BaseException], bool],
+                 deadline: float = 60, hedge: bool = True, hedge_quantile: float = 0.95,
+                 hedge_min: float = 1.0, hedge_default: float = 10.0, max_attempts: int = 3,
+                 retry_base: float = 0.5, breaker_failures: int = 5, breaker_reset: float = 30):
+        self.models = list(dict.fromkeys(m for m in models if m))
+        self.retryable = retryable
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min
+        self.hedge_default = hedge_default
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.breakers = {m: CircuitBreaker(breaker_failures, breaker_reset) for m in self.models}
+        self._latency: Dict[Tuple[Hashable, str], LatencyWindow] = {}
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.retries = 0
+        self.short_circuited = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hedged": self.hedged, "hedge_wins": self.hedge_wins, "retries": self.retries,
+                "short_circuited": self.short_circuited,
+                "open": [m for m, b in self.breakers.items() if b.is_open]}
+
+    def open_circuits(self) -> int:
+        return sum(b.is_open for b in self.breakers.values())
+
+    def hedge_delay(self, kind: Hashable, model: str) -> float:
+        window = self._latency.get((kind, model))
+        p = window.quantile(self.hedge_quantile) if window else None
+        return max(self.hedge_min, p if p is not None else self.hedge_default)
+
+    async def call(self, kind: Hashable, attempt: Attempt, deadline: Optional[float] = None,
+                   discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> Tuple[str, Any]:
+        """Выполняет attempt(model, timeout) с дедлайном, hedging и повторами; возвращает (модель, результат).
+        kind разделяет статистику времени ответа (обычная генерация и первый кусок потока — разные величины);
+        deadline (сек) — вместо общего для этого вызова. discard(result) закрывает лишний результат,
+        если обе попытки успели ответить (например, поток)."""
+        loop = asyncio.get_running_loop()
+        budget = deadline or self.deadline
+        expires = loop.time() + budget
+        tries = 0
+        while True:
+            models = self._available()
+            try:
+                return await self._hedged(kind, models, attempt, expires, budget, discard)
+            except Exception as e:
+                tries += 1
+                if not self.retryable(e) or tries >= self.max_attempts:
+                    raise
+                # Full jitter: одновременно упавшие запросы не повторяются синхронной волной
+                delay = random.uniform(0, self.retry_base * 2 ** (tries - 1))
+                delay = max(delay, _retry_after(e))
+                if loop.time() + delay >= expires:
+                    raise
+                self.retries += 1
+                logger.warning("OpenAI %s failed (%s), retry %d in %.1fs", kind, type(e).__name__, tries, delay)
+                await asyncio.sleep(delay)
+
+    def _available(self) -> List[str]:
+        models = [m for m in self.models if self.breakers[m].allow()]
+        if not models:
+            self.short_circuited += 1
+            wait = min(b.retry_in() for b in self.breakers.values())
+            raise CircuitOpen(f"OpenAI временно недоступен, повторите через {wait:.0f} с")
+        return models
+
+    async def _hedged(self, kind: Hashable, models: List[str], attempt: Attempt, deadline: float, budget: float,
+                      discard: Optional[Callable[[Any], Awaitable[None]]]) -> Tuple[str, Any]:
+        loop = asyncio.get_running_loop()
+        primary = models[0]
+        # Запасная попытка — на следующую модель, если она есть, иначе ещё раз на ту же
+        backup = models[1] if len(models) > 1 else primary
+
+        def launch(model: str) -> asyncio.Task:
+            task = asyncio.create_task(self._attempt(kind, model, attempt, deadline - loop.time()))
+            tasks[task] = model
+            return task
+
+        tasks: Dict[asyncio.Task, str] = {}
+        first = launch(primary)
+        hedge_at = loop.time() + self.hedge_delay(kind, primary) if self.hedge else None
+        winner: Optional[asyncio.Task] = None
+        error: Optional[BaseException] = None
+        try:
+            while True:
+                pending = [t for t in tasks if not t.done()]
+                now = loop.time()
+                if not pending or now >= deadline:
+                    break
+                wake = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, _ = await asyncio.wait(pending, timeout=wake - now, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if t.exception() is None), None)
+                if winner is not None:
+                    break
+                for task in done:
+                    error = task.exception()
+                if hedge_at is not None and loop.time() >= hedge_at and not first.done():
+                    # Первая попытка дольше обычного p95 — отправляем запасную, ответит тот, кто быстрее
+                    hedge_at = None
+                    self.hedged += 1
+                    launch(backup)
+        finally:
+            losers = [t for t in tasks if t is not winner]
+            if winner is None and loop.time() >= deadline:
+                # Не ответила к дедлайну — модель зависла или слишком медленная: это ошибка для предохранителя,
+                # а не проигрыш гонки (отмена ниже лишь снимает пробную попытку)
+                for task in losers:
+                    if not task.done():
+                        self.breakers[tasks[task]].failure()
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+            if discard:
+                # Обе попытки успели ответить — лишний результат закрываем (например, поток)
+                for task in losers:
+                    if not task.cancelled() and task.exception() is None:
+                        await discard(task.result())
+        if winner is not None:
+            if winner is not first:
+                self.hedge_wins += 1
+            return tasks[winner], winner.result()
+        if error is not None and all(t.done() for t in tasks):
+            raise error
+        raise DeadlineExceeded(f"OpenAI не ответил за {budget:g} с")
+
+    async def _attempt(self, kind: Hashable, model: str, attempt: Attempt, timeout: float) -> Any:
+        breaker = self.breakers[model]
+        breaker.begin()
+        started = time.perf_counter()
+        try:
+            result = await attempt(model, timeout)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            if self.retryable(e):
+                breaker.failure()
+            else:
+                breaker.release()
+            raise
+        breaker.success()
+        self._latency.setdefault((kind, model), LatencyWindow()).add(time.perf_counter() - started)
+        return result
+
+
+def _retry_after(error: BaseException) -> float:
+    """Пауза из заголовка Retry-After ответа 429/503, если она есть."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from metrics import Histogram, Registry
+
+logger = logging.getLogger(__name__)
+
+
+class InflightTracker(BaseMiddleware):
+    """Outer-middleware на dp.update: считает апдейты, которые сейчас обрабатываются,
+    чтобы при остановке дождаться их, а не обрывать на середине."""
+
+    def __init__(self):
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.inflight += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.inflight -= 1
+            if not self.inflight:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Ждёт завершения начатых апдейтов; False — если не уложились в timeout."""
+        if self.inflight:
+            logger.info("Waiting for %d in-flight updates…", self.inflight)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("Drain timeout: %d updates still running", self.inflight)
+            return False
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner-middleware на dp.message / dp.callback_query: время каждого обработчика
+    (по имени функции, для роутеров кнопок — с действием) и исход — ok или класс исключения."""
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        # Кнопки с CallbackData идут через один роутер — добавляем действие, иначе все кнопки сольются в одну серию
+        action = getattr(data.get("callback_data"), "action", None)
+        if action:
+            name = f"{name}:{action}"
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            self.histogram.observe(time.perf_counter() - started, handler=name, status=status)
+
+
+def add_metrics_route(app: web.Application, registry: Registry, path: str = "/metrics") -> None:
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app.router.add_get(path, metrics)
+
+
+async def start_metrics_server(registry: Registry, host: str, port: int, path: str = "/metrics") -> web.AppRunner:
+    """Отдельный HTTP-сервер для /metrics (в режиме polling или когда метрики не должны
+    быть на порту вебхука). Остановка — await runner.cleanup()."""
+    app = web.Application()
+    add_metrics_route(app, registry, path)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics on http://%s:%s%s", host, port, path)
+    return runner
+
+
+def stop_event() -> asyncio.Event:
+    """Событие, которое выставляется по SIGINT/SIGTERM (вместо sys.exit в обработчике сигнала)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop.set))
+    return stop
+
+
+async def run_polling(dp: Dispatcher, bot: Bot, tracker: InflightTracker, stop: asyncio.Event,
+                      drop_pending: bool = False, drain_timeout: float = 60) -> None:
+    # Polling не работает при установленном вебхуке; заодно решаем, что делать с накопившимися апдейтами
+    await bot.delete_webhook(drop_pending_updates=drop_pending)
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    stopping = asyncio.create_task(stop.wait())
+    await asyncio.wait({polling, stopping}, return_when=asyncio.FIRST_COMPLETED)
+    stopping.cancel()
+    if not polling.done():
+        logger.info("🛑 Завершение: останавливаем polling…")
+        try:
+            await dp.stop_polling()
+        except RuntimeError:  # сигнал пришёл до старта polling
+            polling.cancel()
+    try:
+        await polling
+    except asyncio.CancelledError:
+        pass
+    # Новые апдейты больше не забираем, а начатые — дорабатываем
+    await tracker.drain(drain_timeout)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, tracker: InflightTracker, stop: asyncio.Event, *,
+                      host: str, port: int, path: str, url: Optional[str] = None,
+                      secret: Optional[str] = None, drop_pending: bool = False,
+                      drain_timeout: float = 60, app: Optional[web.Application] = None) -> None:
+    """aiohttp-сервер с вебхуком aiogram. Без url вебхук в Telegram не регистрируется —
+    удобно для локальной проверки через tools/fake_update_poster.py."""
+    app = app or web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Webhook server listening on http://%s:%s%s", host, port, path)
+    if url:
+        await bot.set_webhook(
+            url,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=drop_pending,
+        )
+    await stop.wait()
+    logger.info("🛑 Завершение: перестаём принимать апдейты…")
+    # Вебхук в Telegram не снимаем: пока бот перезапускается, апдейты копятся и будут доставлены после
+    await site.stop()
+    await tracker.drain(drain_timeout)
+    # cleanup закрывает сессию бота — только после того, как обработчики всё отправили
+    await runner.cleanup()
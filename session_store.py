@@ -0,0 +1,326 @@
+import abc
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from media import MediaItem
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Session:
+    """Черновик поста одного админа."""
+    original_text: str
+    post_text: str
+    media: List[MediaItem] = field(default_factory=list)
+    style: Optional[str] = None  # стиль текущего текста (None — базовая генерация)
+    style_drafts: Dict[str, str] = field(default_factory=dict)  # предгенерированные черновики по стилям
+    prefetch_tokens: int = 0  # сколько токенов ушло на предгенерацию
+    updated_at: float = field(default_factory=time.time)
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "Session":
+        data = json.loads(raw)
+        # Неизвестные поля (от более новой версии) игнорируем
+        known = {f.name for f in fields(cls)}
+        sess = cls(**{k: v for k, v in data.items() if k in known})
+        sess.media = [MediaItem.from_json(m) for m in sess.media]
+        return sess
+
+
+# Начало отсчёта id черновиков (2024-01-01 UTC): id короче, а callback_data укладывается в 64 байта
+_DRAFT_EPOCH_MS = 1_704_067_200_000
+_last_draft_id = 0
+
+
+def new_draft_id() -> int:
+    """Id черновика: миллисекунды от _DRAFT_EPOCH_MS, строго возрастающие. После рестарта id не повторяются,
+    поэтому кнопки под старым сообщением не попадут в чужой черновик."""
+    global _last_draft_id
+    _last_draft_id = max(_last_draft_id + 1, int(time.time() * 1000) - _DRAFT_EPOCH_MS)
+    return _last_draft_id
+
+
+def _encode_key(key: Hashable) -> str:
+    return json.dumps(key)
+
+
+def _decode_key(raw: str) -> Hashable:
+    key = json.loads(raw)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class StateDB:
+    """Фоновое обслуживание хранилищ черновиков и FSM: вытеснение по TTL и,
+    если задан path, отложенная пакетная запись в SQLite (write-behind).
+
+    Хранилища копят изменённые ключи в памяти, а StateDB раз в flush_interval
+    (или раньше, когда набралось batch_size изменений) пишет их одной транзакцией."""
+
+    def __init__(self, path: Optional[str] = None, flush_interval: float = 2.0, batch_size: int = 100):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._conn = sqlite3.connect(path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._tables: List["_WriteBehindTable"] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def persistent(self) -> bool:
+        return self._conn is not None
+
+    def attach(self, table: "_WriteBehindTable") -> None:
+        self._tables.append(table)
+        if self._conn is not None:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table.table} ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def load(self, table: str, newer_than: float) -> List[Tuple[str, str, float]]:
+        if self._conn is None:
+            return []
+        with self._conn:
+            self._conn.execute(f"DELETE FROM {table} WHERE updated_at <= ?", (newer_than,))
+        return self._conn.execute(f"SELECT key, data, updated_at FROM {table}").fetchall()
+
+    def notify(self, pending: int) -> None:
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> None:
+        if self._conn is None:
+            return
+        with self._conn:
+            for table in self._tables:
+                upserts, deletes = table.drain()
+                if upserts:
+                    self._conn.executemany(
+                        f"INSERT OR REPLACE INTO {table.table} (key, data, updated_at) VALUES (?, ?, ?)",
+                        upserts,
+                    )
+                if deletes:
+                    self._conn.executemany(f"DELETE FROM {table.table} WHERE key = ?", [(k,) for k in deletes])
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            for table in self._tables:
+                evicted = table.evict_expired()
+                if evicted:
+                    logger.info("Evicted %d expired %s records", evicted, table.table)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logger.exception("State flush failed")
+
+
+class _WriteBehindTable(abc.ABC):
+    table = ""
+
+    def __init__(self, ttl: float, db: StateDB):
+        self.ttl = ttl
+        self._db = db
+        self._dirty: set = set()
+        self._deleted: set = set()
+        db.attach(self)
+
+    def _mark(self, key: Hashable, deleted: bool = False) -> None:
+        if not self._db.persistent:
+            return
+        if deleted:
+            self._dirty.discard(key)
+            self._deleted.add(key)
+        else:
+            self._deleted.discard(key)
+            self._dirty.add(key)
+        self._db.notify(len(self._dirty) + len(self._deleted))
+
+    def drain(self) -> Tuple[List[Tuple[str, str, float]], List[str]]:
+        # Сериализуем только в момент записи: сколько бы раз черновик ни менялся между сбросами,
+        # на диск уходит одна строка
+        upserts = [row for row in (self._row(k) for k in self._dirty) if row]
+        deletes = [_encode_key(k) for k in self._deleted]
+        self._dirty.clear()
+        self._deleted.clear()
+        return upserts, deletes
+
+    @abc.abstractmethod
+    def evict_expired(self) -> int:
+        ...
+
+    @abc.abstractmethod
+    def _row(self, key: Hashable) -> Optional[Tuple[str, str, float]]:
+        ...
+
+
+class SessionStore(_WriteBehindTable):
+    """Черновики с интерфейсом dict (user_id → Session), как раньше SESSIONS.
+
+    Черновики, не менявшиеся дольше ttl секунд, вытесняются. Поля Session меняются
+    на месте, поэтому после правок нужно вызвать touch(key) — иначе изменение не попадёт на диск."""
+
+    table = "sessions"
+
+    def __init__(self, ttl: float, db: StateDB):
+        super().__init__(ttl, db)
+        self._items: Dict[Hashable, Session] = {}
+        for raw_key, data, _ in db.load(self.table, time.time() - ttl):
+            self._items[_decode_key(raw_key)] = Session.from_json(data)
+
+    def get(self, key: Hashable, default: Optional[Session] = None) -> Optional[Session]:
+        sess = self._items.get(key)
+        if sess is None:
+            return default
+        if sess.updated_at < time.time() - self.ttl:
+            self.pop(key)
+            return default
+        return sess
+
+    def __getitem__(self, key: Hashable) -> Session:
+        sess = self.get(key)
+        if sess is None:
+            raise KeyError(key)
+        return sess
+
+    def __setitem__(self, key: Hashable, sess: Session) -> None:
+        sess.updated_at = time.time()
+        self._items[key] = sess
+        self._mark(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._items))
+
+    def pop(self, key: Hashable, default: Optional[Session] = None) -> Optional[Session]:
+        sess = self._items.pop(key, None)
+        if sess is None:
+            return default
+        self._mark(key, deleted=True)
+        return sess
+
+    def touch(self, key: Hashable) -> None:
+        sess = self._items.get(key)
+        if sess is not None:
+            sess.updated_at = time.time()
+            self._mark(key)
+
+    def evict_expired(self) -> int:
+        deadline = time.time() - self.ttl
+        expired = [k for k, s in self._items.items() if s.updated_at < deadline]
+        for key in expired:
+            self.pop(key)
+        return len(expired)
+
+    def _row(self, key: Hashable) -> Optional[Tuple[str, str, float]]:
+        sess = self._items.get(key)
+        if sess is None:
+            return None
+        return _encode_key(key), sess.to_json(), sess.updated_at
+
+
+class FSMStore(_WriteBehindTable, BaseStorage):
+    """FSM-хранилище aiogram вместо MemoryStorage: хранит только непустые записи,
+    вытесняет старые по ttl и (опционально) переживает рестарт через StateDB."""
+
+    table = "fsm"
+
+    def __init__(self, ttl: float, db: StateDB):
+        super().__init__(ttl, db)
+        # ключ → (state, data, updated_at)
+        self._records: Dict[Tuple, Tuple[Optional[str], Dict[str, Any], float]] = {}
+        for raw_key, raw, updated_at in db.load(self.table, time.time() - ttl):
+            record = json.loads(raw)
+            self._records[_decode_key(raw_key)] = (record["state"], record["data"], updated_at)
+
+    @staticmethod
+    def _key(key: StorageKey) -> Tuple:
+        return key.bot_id, key.chat_id, key.user_id, key.thread_id, key.destiny
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        k = self._key(key)
+        if state is None and not data:
+            # Пустая запись ничем не отличается от отсутствующей — не держим её в памяти
+            if self._records.pop(k, None) is not None:
+                self._mark(k, deleted=True)
+            return
+        self._records[k] = (state, data, time.time())
+        self._mark(k)
+
+    def _get(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        record = self._records.get(self._key(key))
+        if record is None or record[2] < time.time() - self.ttl:
+            return None, {}
+        return record[0], record[1]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = self._get(key)
+        self._put(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._get(key)[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = self._get(key)
+        self._put(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._get(key)[1].copy()
+
+    async def close(self) -> None:
+        # Файл закрывает владелец StateDB
+        pass
+
+    def evict_expired(self) -> int:
+        deadline = time.time() - self.ttl
+        expired = [k for k, r in self._records.items() if r[2] < deadline]
+        for key in expired:
+            del self._records[key]
+            self._mark(key, deleted=True)
+        return len(expired)
+
+    def _row(self, key: Hashable) -> Optional[Tuple[str, str, float]]:
+        record = self._records.get(key)
+        if record is None:
+            return None
+        state, data, updated_at = record
+        return _encode_key(key), json.dumps({"state": state, "data": data}, ensure_ascii=False), updated_at
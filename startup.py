@@ -0,0 +1,46 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Разбивка времени старта по фазам: импорт, конфиг, хранилища, подключение, прогрев."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self._last = started
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, name: str) -> None:
+        """Закрывает фазу, длившуюся с предыдущей отметки."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self, title: str) -> None:
+        breakdown = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.phases)
+        total = time.perf_counter() - self.started
+        logger.info("%s in %.0f ms: %s", title, total * 1000, breakdown)
+
+
+async def warm_up(timer: StartupTimer, steps: List[Tuple[str, Callable[[], Awaitable[None]]]]) -> None:
+    """Фоновый прогрев после того, как бот уже принимает апдейты: ошибки прогрева
+    только логируются — первый настоящий запрос просто сделает ту же работу сам."""
+    for name, step in steps:
+        try:
+            with timer.phase(name):
+                await step()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+    timer.report("Warm-up finished")
@@ -0,0 +1,66 @@
+"""Предохранитель Resilience: зависшая модель должна выключаться так же, как падающая."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from resilience import CircuitOpen, DeadlineExceeded, Resilience  # noqa: E402
+
+
+def make(models=("main",), **kwargs) -> Resilience:
+    return Resilience(list(models), retryable=lambda e: isinstance(e, TimeoutError), deadline=0.05,
+                      hedge=False, max_attempts=1, breaker_failures=3, **kwargs)
+
+
+async def hang(model: str, timeout: float):
+    await asyncio.sleep(3600)
+
+
+def test_hanging_model_opens_circuit():
+    res = make()
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(DeadlineExceeded):
+                await res.call("chat", hang)
+        with pytest.raises(CircuitOpen):
+            await res.call("chat", hang)
+
+    asyncio.run(run())
+    assert res.stats()["open"] == ["main"]
+
+
+def test_hanging_model_fails_over_to_backup():
+    res = make(models=("main", "backup"))
+    calls = []
+
+    async def attempt(model: str, timeout: float):
+        calls.append(model)
+        if model == "main":
+            await hang(model, timeout)
+        return "ok"
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(DeadlineExceeded):
+                await res.call("chat", attempt)
+        return await res.call("chat", attempt)
+
+    assert asyncio.run(run()) == ("backup", "ok")
+    assert calls == ["main"] * 3 + ["backup"]
+
+
+def test_hedge_loser_is_not_a_failure():
+    res = Resilience(["main", "backup"], retryable=lambda e: False, deadline=1, hedge_min=0.01,
+                     hedge_default=0.01, breaker_failures=1)
+
+    async def attempt(model: str, timeout: float):
+        if model == "main":
+            await hang(model, timeout)
+        return model
+
+    assert asyncio.run(res.call("chat", attempt)) == ("backup", "backup")
+    assert res.stats()["open"] == []
@@ -0,0 +1,61 @@
+"""Регрессии быстрого пути parse_event_datetime: где он срабатывает, результат либо совпадает
+с прежним разбором только через dateparser, либо отличается осознанно (время без дня)."""
+import os
+import sys
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import time_parser  # noqa: E402
+
+pytest.importorskip("dateparser")
+
+TZ = ZoneInfo("Europe/Moscow")
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=TZ)
+
+
+def parse(text: str):
+    # Без кэша и с фиксированным «сейчас», чтобы результат не зависел от времени запуска
+    return time_parser._parse_cached.__wrapped__(time_parser._normalize(text), TZ.key, int(NOW.timestamp() // 60))
+
+
+def baseline(text: str):
+    """Как работал parse_event_datetime до быстрого пути: только dateparser, ближайшая будущая дата."""
+    candidates = time_parser._dateparser_candidates(text, NOW)
+    if not candidates:
+        return None
+    candidates.sort(key=lambda d: (d < NOW, abs((d - NOW).total_seconds())))
+    return candidates[0]
+
+
+@pytest.mark.parametrize("text", [
+    "этап пройдёт с 12.11 по 15.11",
+    "к 9.15",
+    "15.11 в 20:00",
+    "завтра в 19:00",
+])
+def test_same_as_baseline(text):
+    assert parse(text) == baseline(text)
+
+
+def test_date_range_is_not_a_time():
+    assert parse("этап пройдёт с 12.11 по 15.11") is None
+
+
+def test_numeric_date_keeps_its_day():
+    assert parse("15.11 в 20:00").date() != NOW.date()
+
+
+def test_bare_time_with_preposition():
+    # dateparser такие фразы не находил; быстрый путь даёт ближайшее наступление этого времени
+    assert baseline("в 10:30") is None
+    assert parse("в 10:30") == datetime(2026, 10, 18, 10, 30, tzinfo=TZ)
+    assert parse("старт в 21:00") == datetime(2026, 10, 17, 21, 0, tzinfo=TZ)
+
+
+def test_lap_times_and_durations_are_ignored():
+    assert parse("лучший круг 1:45.321, старт в 19:00") == datetime(2026, 10, 17, 19, 0, tzinfo=TZ)
+    assert parse("гонка 2.4 часа, старт в 19:00") == datetime(2026, 10, 17, 19, 0, tzinfo=TZ)
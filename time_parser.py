@@ -1,46 +1,134 @@
 import re
-from datetime import datetime
+from datetime import datetime, time, timedelta
+from functools import lru_cache
 from typing import Optional, List
 from zoneinfo import ZoneInfo
 import os
-from dateparser.search import search_dates
 
 
-def parse_event_datetime(text: str, tz_name: Optional[str] = None) -> Optional[datetime]:
-    """Ищет в русском тексте относительную/абсолютную дату и время и
-    возвращает timezone-aware datetime. Игнорирует длительности (например, "2.4 часа").
-    """
-    tz = ZoneInfo(tz_name or os.getenv("TIMEZONE", "Europe/Moscow"))
-    now = datetime.now(tz)
+_DURATION_RE = re.compile(r"\b\d+(?:[\.,]\d+)?\s*(?:час(?:а|ов)?|ч)\b", re.IGNORECASE)
+
+_MONTHS = {
+    'январь': 1, 'января': 1, 'февраль': 2, 'февраля': 2, 'март': 3, 'марта': 3,
+    'апрель': 4, 'апреля': 4, 'май': 5, 'мая': 5, 'июнь': 6, 'июня': 6,
+    'июль': 7, 'июля': 7, 'август': 8, 'августа': 8, 'сентябрь': 9, 'сентября': 9,
+    'октябрь': 10, 'октября': 10, 'ноябрь': 11, 'ноября': 11, 'декабрь': 12, 'декабря': 12,
+}
+_WEEKDAYS = {
+    'понедельник': 0, 'вторник': 1, 'среда': 2, 'среду': 2, 'четверг': 3,
+    'пятница': 4, 'пятницу': 4, 'суббота': 5, 'субботу': 5, 'воскресенье': 6,
+}
+_RELATIVE_DAYS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+
+# Время: 19:00 / 19.00, но не время круга вида 1:45.321 и не длительность «2.40 ч»
+_TIME = r"(?<![\d:.,])(?P<{h}>[01]?\d|2[0-3])[{sep}](?P<{m}>[0-5]\d)(?!\d|[.:,]\d|\s*ч)"
+# Дата цифрами: 15.11, 15.11.2025 — рядом с ней время без дня быстрым путём не разбираем
+_NUMERIC_DATE_RE = re.compile(r"(?<![\d:.,])(?:0?[1-9]|[12]\d|3[01])\.(?:0?[1-9]|1[0-2])(?:\.(?:20)?\d\d)?(?![\d:]|\s*ч)")
+# Быстрый путь для типичных фраз: «завтра в 19:00», «в субботу», «15 августа в 20:30», «старт в 21:00»
+_FAST_RE = re.compile(
+    r"(?:\b(?P<rel>послезавтра|завтра|сегодня)\b"
+    r"|\b(?P<wd>" + "|".join(_WEEKDAYS) + r")\b"
+    r"|(?<!\d)(?P<day>[12]?\d|3[01])\s+(?P<mon>" + "|".join(_MONTHS) + r")\b(?:\s+(?P<year>20\d\d))?)"
+    r"(?:\s*(?:г\.|года)?\s*,?\s*(?:в|к|с|на)?\s*" + _TIME.format(h='h', m='m', sep=':.') + r")?"
+    # время без дня — только с предлогом и только через двоеточие: «с 12.11» — это дата, а не 12:11
+    r"|\b(?:в|к|с)\s+" + _TIME.format(h='th', m='tm', sep=':')
+)
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").lower().replace('ё', 'е').split())
+
+
+def _fast_candidates(text: str, now: datetime) -> List[datetime]:
+    candidates: List[datetime] = []
+    # «15.11 в 20:00»: день указан цифрами, которые быстрый путь не понимает, — пусть разбирает dateparser
+    numeric_date = _NUMERIC_DATE_RE.search(text) is not None
+    for m in _FAST_RE.finditer(text):
+        if m.group('th'):
+            if numeric_date:
+                continue
+            dt = now.replace(hour=int(m.group('th')), minute=int(m.group('tm')), second=0, microsecond=0)
+            if dt < now:
+                dt += timedelta(days=1)
+            candidates.append(dt)
+            continue
+        at = time(int(m.group('h')), int(m.group('m'))) if m.group('h') else None
+        if m.group('rel'):
+            days = _RELATIVE_DAYS[m.group('rel')]
+            if at is None:
+                # Как и dateparser: «завтра» без времени — то же время суток, что сейчас
+                candidates.append(now + timedelta(days=days))
+            else:
+                candidates.append(datetime.combine(now.date() + timedelta(days=days), at, tzinfo=now.tzinfo))
+        elif m.group('wd'):
+            days = (_WEEKDAYS[m.group('wd')] - now.weekday()) % 7
+            dt = datetime.combine(now.date() + timedelta(days=days), at or time(0, 0), tzinfo=now.tzinfo)
+            if dt < now:
+                dt += timedelta(days=7)
+            candidates.append(dt)
+        else:
+            year = int(m.group('year') or now.year)
+            try:
+                dt = datetime(year, _MONTHS[m.group('mon')], int(m.group('day')), tzinfo=now.tzinfo)
+            except ValueError:  # 31 февраля и т.п.
+                continue
+            if at is not None:
+                dt = dt.replace(hour=at.hour, minute=at.minute)
+            if dt < now and not m.group('year'):
+                try:
+                    dt = dt.replace(year=year + 1)
+                except ValueError:  # 29 февраля
+                    continue
+            candidates.append(dt)
+    return candidates
+
+
+def _dateparser_candidates(text: str, now: datetime) -> List[datetime]:
+    # dateparser тяжёлый (загрузка языковых данных, сотни мс на длинном тексте) — импортируем только здесь
+    from dateparser.search import search_dates
 
     settings = {
         'RELATIVE_BASE': now,
         'PREFER_DATES_FROM': 'future',
-        'TIMEZONE': tz.key,
+        'TIMEZONE': now.tzinfo.key,
         'RETURN_AS_TIMEZONE_AWARE': True,
     }
+    candidates: List[datetime] = []
+    for snippet, dt in search_dates(text, languages=['ru'], settings=settings) or []:
+        # фильтруем длительности
+        if _DURATION_RE.search(snippet):
+            continue
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=now.tzinfo)
+        candidates.append(dt)
+    return candidates
 
-    def is_duration(snippet: str) -> bool:
-        return bool(re.search(r"\b\d+(?:[\.,]\d+)?\s*(?:час(?:а|ов)?|ч)\b", snippet, re.IGNORECASE))
 
+@lru_cache(maxsize=1024)
+def _parse_cached(text: str, tz_key: str, base_minute: int) -> Optional[datetime]:
+    tz = ZoneInfo(tz_key)
+    now = datetime.fromtimestamp(base_minute * 60, tz)
     try:
-        results = search_dates(text, languages=['ru'], settings=settings) or []
-        candidates: List[datetime] = []
-        for snippet, dt in results:
-            # фильтруем длительности
-            if is_duration(snippet):
-                continue
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=tz)
-            candidates.append(dt)
-
-        if candidates:
-            # Берём ближайшую (предпочтительно будущую)
-            candidates.sort(key=lambda d: (d < now, abs((d - now).total_seconds())))
-            return candidates[0]
+        candidates = _fast_candidates(text, now) or _dateparser_candidates(text, now)
     except Exception:
-        pass
-    return None
+        return None
+    if not candidates:
+        return None
+    # Берём ближайшую (предпочтительно будущую)
+    candidates.sort(key=lambda d: (d < now, abs((d - now).total_seconds())))
+    return candidates[0]
+
+
+def parse_event_datetime(text: str, tz_name: Optional[str] = None) -> Optional[datetime]:
+    """Ищет в русском тексте относительную/абсолютную дату и время и
+    возвращает timezone-aware datetime. Игнорирует длительности (например, "2.4 часа").
+
+    Типичные фразы разбираются готовыми регулярками, dateparser — только если они ничего не нашли.
+    Результат кэшируется по (нормализованный текст, часовой пояс, текущая минута).
+    """
+    tz = ZoneInfo(tz_name or os.getenv("TIMEZONE", "Europe/Moscow"))
+    now = datetime.now(tz)
+    return _parse_cached(_normalize(text), tz.key, int(now.timestamp() // 60))
 
 
 def format_dt_ru(dt: datetime) -> str:
@@ -51,3 +139,9 @@ def format_dt_ru(dt: datetime) -> str:
     tz_abbr = dt.tzname() or 'МСК'
     return f"{dt.day} {months[dt.month - 1]} {dt.year}, {dt:%H:%M} {tz_abbr}"
 
+
+def warm_up() -> None:
+    """Заранее загружает dateparser с русскими языковыми данными (сотни мс), чтобы их не ждал
+    первый текст, не разобранный быстрым путём. Блокирующая — вызывать в отдельном потоке."""
+    tz = ZoneInfo(os.getenv("TIMEZONE", "Europe/Moscow"))
+    _dateparser_candidates("гонка в следующую пятницу вечером", datetime.now(tz))
@@ -0,0 +1,88 @@
+"""Шлёт синтетические апдейты Telegram в локальный вебхук бота (BOT_MODE=webhook).
+
+Пример:
+    python tools/fake_update_poster.py --text "Завтра в 19:00 гонка на Спа" --count 20 --concurrency 5
+    python tools/fake_update_poster.py --callback regenerate
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import time
+
+import aiohttp
+
+_update_ids = itertools.count(int(time.time()))
+
+
+def make_message_update(user_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+def make_callback_update(user_id: int, data: str) -> dict:
+    update_id = next(_update_ids)
+    user = {"id": user_id, "is_bot": False, "first_name": "Test"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "…",
+            },
+        },
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8080')}"
+                                         f"{os.getenv('WEBHOOK_PATH', '/webhook')}")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--text", default="Сегодня финишировали третьими на 6 часах Нюрбургринга")
+    parser.add_argument("--callback", help="вместо текста отправить нажатие кнопки с этими callback_data")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def post(session: aiohttp.ClientSession, i: int) -> float:
+        if args.callback:
+            update = make_callback_update(args.user_id + i, args.callback)
+        else:
+            update = make_message_update(args.user_id + i, args.text)
+        async with limit:
+            started = time.perf_counter()
+            async with session.post(args.url, json=update, headers=headers) as resp:
+                if resp.status != 200:
+                    print(f"update {update['update_id']}: HTTP {resp.status} {await resp.text()}")
+            return time.perf_counter() - started
+
+    async with aiohttp.ClientSession() as session:
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(post(session, i) for i in range(args.count)))
+        total = time.perf_counter() - started
+    print(f"sent {args.count} updates in {total:.2f}s, max ack {max(latencies) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())